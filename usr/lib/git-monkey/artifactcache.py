@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+import subprocess
+import buildgraph
+import util
+
+# Packages whose versions decide whether a cached build is still valid
+TOOLCHAIN_PACKAGES = ["gcc", "g++", "cpp", "binutils", "libc6-dev", "dpkg-dev", "debhelper", "fakeroot"]
+
+MANIFEST_FILE = "manifest.json"
+
+def snapshot_dir(dir):
+    snapshot = {}
+    try:
+        names = os.listdir(dir)
+    except OSError:
+        return snapshot
+    for name in names:
+        try:
+            st = os.stat(os.path.join(dir, name))
+        except OSError:
+            continue
+        snapshot[name] = (st.st_mtime, st.st_size)
+    return snapshot
+
+def get_package_prefixes(repo_dir):
+    try:
+        info = buildgraph.ControlInfo(os.path.join(repo_dir, "debian", "control"))
+    except IOError:
+        return []
+    names = set(info.binaries)
+    if info.source is not None:
+        names.add(info.source)
+    return [name + "_" for name in names]
+
+def get_toolchain_fingerprint():
+    try:
+        process = subprocess.Popen(["dpkg-query", "-W", "-f", "${Package} ${Version} ${Architecture}\n"] + TOOLCHAIN_PACKAGES,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, error = process.communicate()
+    except OSError:
+        output = ""
+    # dpkg-query exits non-zero if some package isn't installed - what it did print is still good
+    return "\n".join(sorted(output.splitlines()))
+
+class ArtifactCache:
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.toolchain = None
+        # Restores and stores run on worker threads
+        self.lock = threading.Lock()
+        self.stats_path = os.path.join(self.path, "stats.json")
+        stats = util.load_json(self.stats_path, {})
+        self.hits = stats.get("hits", 0)
+        self.misses = stats.get("misses", 0)
+
+    def count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.save_stats()
+
+    def save_stats(self):
+        util.save_json(self.stats_path, {"hits": self.hits, "misses": self.misses}, "artifact cache stats")
+
+    def get_tree(self, repo_dir, commit=None):
+        # Only a clean checkout is fully described by its tree hash - a commit always is.
+        # Untracked (non-ignored) files count too, they may well be new sources.
+        if commit is None and util.run_git(repo_dir, ["status", "--porcelain", "-unormal"]) != "":
+            return None
+        tree = util.run_git(repo_dir, ["rev-parse", "%s^{tree}" % (commit or "HEAD")])
+        if tree is None:
+            return None
+        return tree.strip()
+
+    def get_key(self, tree, command):
+        if self.toolchain is None:
+            self.toolchain = get_toolchain_fingerprint()
+        return hashlib.sha1("\0".join([tree, command, self.toolchain])).hexdigest()
+
+    def get_entry_dir(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def restore(self, key, dest_dir):
+        entry_dir = self.get_entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, MANIFEST_FILE)) as f:
+                names = json.load(f)
+            for name in names:
+                shutil.copy2(os.path.join(entry_dir, name), os.path.join(dest_dir, name))
+            # Mark as recently used for eviction
+            os.utime(entry_dir, None)
+        except (IOError, OSError, ValueError):
+            self.count(False)
+            return None
+        self.count(True)
+        return names
+
+    def store(self, key, repo_dir, dest_dir, before):
+        prefixes = get_package_prefixes(repo_dir)
+        after = snapshot_dir(dest_dir)
+        names = [name for name in after
+                 if after[name] != before.get(name) and any(name.startswith(prefix) for prefix in prefixes)]
+        if not names:
+            return []
+        entry_dir = self.get_entry_dir(key)
+        tmp_dir = entry_dir + ".tmp"
+        try:
+            shutil.rmtree(tmp_dir, True)
+            os.makedirs(tmp_dir)
+            for name in names:
+                shutil.copy2(os.path.join(dest_dir, name), os.path.join(tmp_dir, name))
+            with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+                json.dump(names, f)
+            with self.lock:
+                shutil.rmtree(entry_dir, True)
+                os.rename(tmp_dir, entry_dir)
+                self.evict()
+        except (IOError, OSError), detail:
+            print "Could not store build artifacts: %s" % detail
+            shutil.rmtree(tmp_dir, True)
+            return []
+        return names
+
+    def get_entries(self):
+        entries = []
+        try:
+            buckets = os.listdir(self.path)
+        except OSError:
+            return entries
+        for bucket in buckets:
+            bucket_dir = os.path.join(self.path, bucket)
+            if not os.path.isdir(bucket_dir):
+                continue
+            for key in os.listdir(bucket_dir):
+                entry_dir = os.path.join(bucket_dir, key)
+                if key.endswith(".tmp"):
+                    continue
+                size = 0
+                for name in os.listdir(entry_dir):
+                    size += os.path.getsize(os.path.join(entry_dir, name))
+                entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+        return entries
+
+    def evict(self):
+        if self.max_size <= 0:
+            return
+        entries = sorted(self.get_entries())
+        total = sum([size for mtime, size, entry_dir in entries])
+        # Least recently used first
+        for mtime, size, entry_dir in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry_dir, True)
+            total -= size
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import os
+
+# Debian's ccache package puts gcc/g++/cc/c++ wrappers here
+CCACHE_WRAPPER_DIR = "/usr/lib/ccache"
+
+STATS_LOG_FILE = "ccache-stats.log"
+
+# Result names written to CCACHE_STATSLOG (ccache >= 4.4)
+CCACHE_HIT_RESULTS = ("direct_cache_hit", "preprocessed_cache_hit", "cache_hit_direct", "cache_hit_preprocessed")
+CCACHE_MISS_RESULTS = ("cache_miss",)
+
+def get_ccache_env(base_env, cache_dir, max_size_mb, base_dir, stats_log=None):
+    if not os.path.isdir(CCACHE_WRAPPER_DIR):
+        print "ccache is not installed (%s is missing) - building without a compiler cache" % CCACHE_WRAPPER_DIR
+        return base_env
+    env = dict(base_env)
+    env["PATH"] = CCACHE_WRAPPER_DIR + os.pathsep + env.get("PATH", "")
+    env["CCACHE_DIR"] = cache_dir
+    env["CCACHE_MAXSIZE"] = "%dM" % max_size_mb
+    # Builds of the same package from different checkouts/worktrees should share entries
+    env["CCACHE_BASEDIR"] = base_dir
+    env["CCACHE_NOHASHDIR"] = "1"
+    if stats_log is not None:
+        env["CCACHE_STATSLOG"] = stats_log
+    return env
+
+def read_stats_log(path):
+    # Returns (hits, misses) for the compilations recorded in a job's stats log
+    hits = 0
+    misses = 0
+    try:
+        with open(path) as f:
+            for line in f:
+                result = line.strip()
+                if result in CCACHE_HIT_RESULTS:
+                    hits += 1
+                elif result in CCACHE_MISS_RESULTS:
+                    misses += 1
+    except IOError:
+        return None
+    return (hits, misses)
+
+def set_parallel_option(options, slots):
+    options = [option for option in options.split() if not option.startswith("parallel=")]
+    options.append("parallel=%d" % slots)
+    return " ".join(options)
+
+class JobServer:
+    # A GNU make jobserver shared by every build we run. Each top-level make
+    # owns one implicit slot, so the pipe holds what is left once every
+    # concurrent build has its own.
+    def __init__(self, slots, builds):
+        self.slots = max(1, slots)
+        self.builds = max(1, builds)
+        self.tokens = max(1, self.slots - self.builds)
+        self.read_fd = -1
+        self.write_fd = -1
+        self.reset()
+
+    def reset(self):
+        # Tokens held by a make that got killed never come back, so start
+        # over with a fresh pipe whenever no build is using the old one
+        self.close()
+        self.read_fd, self.write_fd = os.pipe()
+        os.write(self.write_fd, "+" * self.tokens)
+
+    def close(self):
+        for fd in (self.read_fd, self.write_fd):
+            if fd >= 0:
+                os.close(fd)
+        self.read_fd = -1
+        self.write_fd = -1
+
+    def get_env(self, base_env):
+        env = dict(base_env)
+        flags = env.get("MAKEFLAGS", "")
+        env["MAKEFLAGS"] = ("%s -j%d --jobserver-auth=%d,%d" % (flags, self.slots, self.read_fd, self.write_fd)).strip()
+        # debhelper runs make -j<parallel>, and make drops an inherited jobserver when
+        # given an explicit -j - so dh builds only get their share of the slots, which
+        # keeps the total within bounds even though they don't take part in the pool
+        env["DEB_BUILD_OPTIONS"] = set_parallel_option(env.get("DEB_BUILD_OPTIONS", ""), max(1, self.slots / self.builds))
+        return env
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+import os
+import re
+
+BUILD_DEP_FIELDS = ("build-depends", "build-depends-indep", "build-depends-arch")
+
+# Version constraints, architecture lists and build profiles - we only want names
+RELATION_NOISE = re.compile(r"\([^)]*\)|\[[^\]]*\]|<[^>]*>")
+
+def parse_paragraphs(text):
+    paragraphs = []
+    fields = {}
+    key = None
+    for line in text.splitlines():
+        if line.strip() == "":
+            if fields:
+                paragraphs.append(fields)
+            fields = {}
+            key = None
+        elif line.startswith("#"):
+            continue
+        elif line[0] in " \t":
+            if key is not None:
+                fields[key] += "\n" + line.strip()
+        elif ":" in line:
+            key, value = line.split(":", 1)
+            key = key.strip().lower()
+            fields[key] = value.strip()
+    if fields:
+        paragraphs.append(fields)
+    return paragraphs
+
+def parse_relations(value):
+    names = set()
+    value = RELATION_NOISE.sub("", value)
+    for relation in value.replace("\n", " ").split(","):
+        for alternative in relation.split("|"):
+            name = alternative.strip().split(":")[0]
+            if name != "":
+                names.add(name)
+    return names
+
+class ControlInfo:
+    def __init__(self, path):
+        self.source = None
+        self.build_depends = set()
+        self.binaries = set()
+        with open(path) as f:
+            paragraphs = parse_paragraphs(f.read())
+        if not paragraphs:
+            return
+        source = paragraphs[0]
+        self.source = source.get("source")
+        for field in BUILD_DEP_FIELDS:
+            if field in source:
+                self.build_depends |= parse_relations(source[field])
+        for binary in paragraphs[1:]:
+            if "package" in binary:
+                self.binaries.add(binary["package"])
+
+class BuildGraph:
+    def __init__(self, repos):
+        self.repos = list(repos)
+        # repo -> set of managed repos it needs built first
+        self.deps = {}
+        producers = {}
+        infos = {}
+        for repo in self.repos:
+            try:
+                infos[repo] = ControlInfo(os.path.join(repo.dir, "debian", "control"))
+            except IOError:
+                infos[repo] = None
+                continue
+            for binary in infos[repo].binaries:
+                producers[binary] = repo
+        for repo in self.repos:
+            self.deps[repo] = set()
+            if infos[repo] is None:
+                continue
+            for name in infos[repo].build_depends:
+                producer = producers.get(name)
+                if producer is not None and producer != repo:
+                    self.deps[repo].add(producer)
+
+    def get_waves(self):
+        # Kahn's algorithm, one wave at a time, keeping the caller's order within a wave
+        remaining = list(self.repos)
+        done = set()
+        waves = []
+        while remaining:
+            wave = [repo for repo in remaining if self.deps[repo] <= done]
+            if not wave:
+                # A dependency cycle - build what's left in the original order
+                print "Build dependency cycle between: %s" % ", ".join([repo.name for repo in remaining])
+                waves.append(remaining)
+                break
+            waves.append(wave)
+            done |= set(wave)
+            remaining = [repo for repo in remaining if repo not in done]
+        return waves
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import os
+import hashlib
+import util
+
+# What get_diff_fingerprint returns for a checkout without uncommitted changes
+CLEAN_DIFF = hashlib.sha1("").hexdigest()
+
+def get_diff_fingerprint(dir):
+    # Uncommitted changes to tracked files by content
+    return util.hash_git(dir, ["diff", "HEAD", "--binary"])
+
+def get_untracked_fingerprint(dir):
+    # Untracked (non-ignored) files by name, size and mtime
+    digest = hashlib.sha1()
+    others = util.run_git(dir, ["ls-files", "--others", "--exclude-standard", "-z"]) or ""
+    for path in sorted(others.split("\0")):
+        if path == "":
+            continue
+        try:
+            st = os.lstat(os.path.join(dir, path))
+            digest.update("%s %r %d\0" % (path, st.st_mtime, st.st_size))
+        except OSError:
+            digest.update("%s missing\0" % path)
+    return digest.hexdigest()
+
+def get_fingerprint(dir, command):
+    head = util.run_git(dir, ["rev-parse", "HEAD"])
+    tree = util.run_git(dir, ["rev-parse", "HEAD^{tree}"])
+    dirty = get_diff_fingerprint(dir)
+    if head is None or tree is None or dirty is None:
+        return None
+    return {"head": head.strip(), "tree": tree.strip(), "dirty": dirty,
+            "untracked": get_untracked_fingerprint(dir), "command": command}
+
+def has_same_sources(before, after):
+    # Whether a build saw the tree as it is now. Untracked files don't count -
+    # a build leaves its own behind.
+    if before is None or after is None:
+        return False
+    for key in ("head", "tree", "dirty", "command"):
+        if before[key] != after[key]:
+            return False
+    return True
+
+def get_commit_fingerprint(dir, commit, command):
+    # For builds of a pinned commit in a worktree, where nothing is uncommitted
+    tree = util.run_git(dir, ["rev-parse", "%s^{tree}" % commit])
+    if tree is None:
+        return None
+    return {"head": commit, "tree": tree.strip(), "dirty": None, "untracked": None, "command": command}
+
+class BuildStamps:
+    def __init__(self, path):
+        self.path = path
+        self.stamps = util.load_json(self.path, {})
+
+    def save(self):
+        util.save_json(self.path, self.stamps, "build stamps")
+
+    def is_up_to_date(self, dir, fingerprint):
+        return fingerprint is not None and self.stamps.get(dir) == fingerprint
+
+    def record(self, dir, fingerprint):
+        if fingerprint is None:
+            self.forget(dir)
+            return
+        self.stamps[dir] = fingerprint
+        self.save()
+
+    def forget(self, dir):
+        if self.stamps.pop(dir, None) is not None:
+            self.save()
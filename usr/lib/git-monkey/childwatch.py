@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import os
+import errno
+import ctypes
+import threading
+from gi.repository import GLib
+
+# GLib's child watch reaps without handing over the rusage, so children are
+# reaped here with wait4 instead - once a pidfd for the child becomes readable
+# (Linux 5.3+), or from a thread blocked in wait4 where there are no pidfds.
+# Either way nothing polls.
+
+# The same on every architecture but alpha
+SYS_PIDFD_OPEN = 434
+
+libc = ctypes.CDLL(None, use_errno=True)
+
+def pidfd_open(pid):
+    fd = libc.syscall(SYS_PIDFD_OPEN, pid, 0)
+    if fd < 0:
+        return None
+    return fd
+
+def reap(pid):
+    # Returns (status, rusage), or (None, None) if somebody else reaped it
+    while True:
+        try:
+            pid, status, rusage = os.wait4(pid, 0)
+            return (status, rusage)
+        except OSError, detail:
+            if detail.errno != errno.EINTR:
+                return (None, None)
+
+def watch(pid, callback, data):
+    # callback(status, rusage, data) is called from the main loop
+    fd = pidfd_open(pid)
+    if fd is not None:
+        GLib.unix_fd_add_full(GLib.PRIORITY_DEFAULT, fd, GLib.IOCondition.IN, on_pidfd_ready, (pid, callback, data))
+        return
+    thread = threading.Thread(target=wait_for_child, args=(pid, callback, data))
+    thread.daemon = True
+    thread.start()
+
+def on_pidfd_ready(fd, condition, watched):
+    pid, callback, data = watched
+    status, rusage = reap(pid)
+    os.close(fd)
+    callback(status, rusage, data)
+    return False
+
+def wait_for_child(pid, callback, data):
+    status, rusage = reap(pid)
+    GLib.idle_add(callback, status, rusage, data)
@@ -5,8 +5,40 @@ SCHEMA = "com.linuxmint.git-monkey"
 
 # Settings keys
 KEY_BUILD = "build-command"
+KEY_BUILD_WORKTREES = "build-worktrees"
+KEY_FAST_CLEAN = "fast-clean"
+KEY_SKIP_UNCHANGED_BUILDS = "skip-unchanged-builds"
+KEY_ARTIFACT_CACHE_SIZE = "artifact-cache-size"
+KEY_COMPILER_CACHE = "compiler-cache"
+KEY_COMPILER_CACHE_DIR = "compiler-cache-dir"
+KEY_COMPILER_CACHE_SIZE = "compiler-cache-size"
+KEY_SHARED_JOBSERVER = "shared-jobserver"
+KEY_JOBSERVER_SLOTS = "jobserver-slots"
+KEY_THROTTLE_LOAD = "throttle-load"
+KEY_THROTTLE_CPU_PRESSURE = "throttle-cpu-pressure"
+KEY_THROTTLE_MEMORY_PRESSURE = "throttle-memory-pressure"
+KEY_THROTTLE_IO_PRESSURE = "throttle-io-pressure"
+KEY_JOB_PROFILES = "job-profiles"
 KEY_REPOS = "repos"
 KEY_DEV_MODE = "dev-mode"
+KEY_OUTPUT_SCROLLBACK = "output-scrollback"
+KEY_LOG_RETENTION = "log-retention"
+KEY_ERROR_PATTERNS = "error-patterns"
+KEY_WARNING_PATTERNS = "warning-patterns"
+KEY_MAX_JOBS = "max-jobs"
+KEY_MAX_NETWORK_JOBS = "max-network-jobs"
+KEY_MAX_BUILD_JOBS = "max-build-jobs"
+KEY_MAX_DISK_JOBS = "max-disk-jobs"
+KEY_MAX_FETCH_JOBS = "max-fetch-jobs"
+KEY_PR_PREFETCH_INTERVAL = "pr-prefetch-interval"
+KEY_DRIFT_INTERVAL = "drift-interval"
+KEY_DRIFT_WORKERS = "drift-workers"
+KEY_MAINTENANCE_INTERVAL = "maintenance-interval"
+KEY_STATUS_WORKERS = "status-workers"
+KEY_STATUS_CACHE = "status-cache"
+KEY_WATCH_REPOS = "watch-repos"
+KEY_WATCH_WORKTREE = "watch-worktree"
+KEY_WATCH_DEBOUNCE = "watch-debounce"
 
 # Repo states
 STATE_NONE = -1
@@ -32,6 +64,16 @@ STATE_REBASED = 17
 STATE_CLEANED = 18
 STATE_PULL_REQUEST_CHECKED_OUT = 19
 STATE_ABORTED = 20
+STATE_SKIPPED = 21
+STATE_BUILD_FAILED = 22
+STATE_UP_TO_DATE = 23
+STATE_RESTORED = 24
+STATE_THROTTLED = 25
+STATE_REBASE_FAILED = 26
+STATE_FETCH_QUEUED = 27
+STATE_FETCHING = 28
+STATE_FETCHED = 29
+STATE_FETCH_FAILED = 30
 
 # Job states
 JOB_BUILD = 1
@@ -39,4 +81,33 @@ JOB_REBASE = 2
 JOB_RESET = 3
 JOB_CLEAN = 4
 JOB_NEW_BRANCH = 5
-JOB_CHECKOUT_PR = 6
\ No newline at end of file
+JOB_CHECKOUT_PR = 6
+JOB_FETCH = 7
+
+# Job names (used for log directories)
+JOB_NAMES = {
+    JOB_BUILD: "build",
+    JOB_REBASE: "rebase",
+    JOB_RESET: "reset",
+    JOB_CLEAN: "clean",
+    JOB_NEW_BRANCH: "new-branch",
+    JOB_CHECKOUT_PR: "pull-request",
+    JOB_FETCH: "fetch"
+}
+
+# What a job shows in the Job Queue column until it starts
+JOB_QUEUED_STATES = {
+    JOB_BUILD: STATE_BUILD_QUEUED,
+    JOB_REBASE: STATE_REBASE_QUEUED,
+    JOB_RESET: STATE_RESET_QUEUED,
+    JOB_CLEAN: STATE_CLEAN_QUEUED,
+    JOB_NEW_BRANCH: STATE_NEW_BRANCH_QUEUED,
+    JOB_CHECKOUT_PR: STATE_PULL_REQUEST_QUEUED,
+    JOB_FETCH: STATE_FETCH_QUEUED
+}
+
+# Job classes (for concurrency limits)
+JOB_CLASS_NETWORK = 1
+JOB_CLASS_CPU = 2
+JOB_CLASS_DISK = 3
+JOB_CLASS_FETCH = 4
@@ -2,16 +2,54 @@
 
 import os
 import sys
+import errno
+import fcntl
 import signal
+import time
+import pipes
 from subprocess import STDOUT
 import subprocess
 import git
 import repoedit
+import repostatus
+import repowatch
+import joblog
+import buildgraph
+import buildstamp
+import artifactcache
+import buildenv
+import pressure
+import jobprofile
+import prcache
+import upstream
+import maintenance
+import worktree
+import trash
+import jobstats
+import jobqueue
+import childwatch
+import util
 from constants import *
 from gi.repository import Gdk, Gtk, GObject, GLib, Pango, GdkPixbuf, Gio
 GObject.threads_init()
 home = os.path.expanduser("~")
 
+# Output is flushed into the text view at most this often (ms) - about once per frame
+OUTPUT_FLUSH_INTERVAL = 16
+OUTPUT_READ_SIZE = 65536
+
+# How often (s) throttled jobs are checked against the current pressure again
+THROTTLE_RECHECK_INTERVAL = 2
+
+# Lines of a job log loaded into the view at a time
+LOG_WINDOW_LINES = 1000
+
+# How often (s) idle repos are checked for due maintenance
+MAINTENANCE_CHECK_INTERVAL = 60
+
+# How often (s) the predicted finish times in the Job Queue column are redone
+ETA_REFRESH_INTERVAL = 2
+
 s = Gio.Settings.new(SCHEMA)
 
 if not s.get_boolean(KEY_DEV_MODE):
@@ -20,16 +58,11 @@ else:
     BUILDER_FILE = "./git-monkey.glade"
     print "Warning - developer mode active"
 
-def get_first(iterable, default=None):
-    if iterable:
-        for item in iterable:
-            return item
-    return default
-
-def front_pop(iterable):
-    item = get_first(iterable)
-    if item:
-        iterable.remove(item)
+def get_cpu_count():
+    try:
+        return max(1, os.sysconf("SC_NPROCESSORS_ONLN"))
+    except (ValueError, OSError):
+        return 1
 
 class GitRepo(git.Repo):
     def __init__(self, dir, upstream_remote, upstream_branch, push_remote = None):
@@ -40,8 +73,37 @@ class GitRepo(git.Repo):
         self.upstream_remote = upstream_remote
         self.upstream_branch = upstream_branch
         self.push_remote = push_remote
-        self.state = []
         self.last_finished_state = STATE_NONE
+        self.last_job_log = None
+        self.last_ccache_stats = None
+        self.last_job_usage = None
+        self.throttle_reason = None
+        self.status = repostatus.RepoStatus()
+        self.drift = None
+
+    def get_upstream_ref(self):
+        return "refs/remotes/%s/%s" % (self.upstream_remote, self.upstream_branch)
+
+    def get_remote_host(self):
+        try:
+            url = self.config_reader().get_value('remote "%s"' % self.upstream_remote, "url")
+        except Exception:
+            return ""
+        if "://" in url:
+            # scheme://[user@]host[:port]/path
+            host = url.split("://", 1)[1].split("/", 1)[0]
+            return host.split("@")[-1].split(":")[0]
+        elif ":" in url.split("/", 1)[0]:
+            # scp-like [user@]host:path
+            return url.split(":", 1)[0].split("@")[-1]
+        return ""
+
+    def get_branch_name(self):
+        if self.status.branch is not None:
+            return self.status.branch
+        elif self.status.oid is not None:
+            return "(detached at %s)" % self.status.oid[:7]
+        return "(unknown)"
 
 class Job:
     def __init__(self, repo, job_type, output_callback, finished_callback):
@@ -50,131 +112,593 @@ class Job:
         self.output_callback = output_callback
         self.finished_callback = finished_callback
         self.process = None
+        self.state = JOB_QUEUED_STATES[job_type]
         self.new_branch_name = ""
         self.aborted = False
+        self.skipped = False
+        self.throttled = False
+        self.queued_state = STATE_NONE
+        self.finished = False
+        self.depends_on = []
+        self.log = None
+        self.build_stamps = None
+        self.build_command = None
+        self.force = False
+        self.local = False
+        self.pr_numbers = []
+        self.up_to_date = False
+        self.artifact_cache = None
+        self.artifact_key = None
+        self.artifact_tree = None
+        self.artifact_snapshot = None
+        self.restored = False
+        self.stored = []
+        self.stale = False
+        self.published = None
+        self.ccache_stats = None
+        self.jobserver = None
+        self.isolated = False
+        self.worktree_root = None
+        self.work_dir = repo.dir
+        self.fingerprint = None
+        self.output_snapshot = None
+        self.trash_reaper = None
+        self.trashed = None
+        self.started = None
+        self.usage = None
+        self.seq = None
+        self.estimate = None
+        self.interactive = False
+        self.background = None
+        self.preparing = False
+        self.prepared_callback = None
+
+    def uses_checkout(self):
+        # Anything but an isolated build touches the main checkout - and an isolated
+        # one does too, until it has pinned the commit it builds
+        return not self.isolated or self.preparing
+
+    def succeeded(self):
+        if not self.finished or self.aborted:
+            return False
+        return self.process is None or self.process.returncode == 0
+
+    def open_log(self, cmd):
+        settings = Gio.Settings.new(SCHEMA)
+        try:
+            patterns = joblog.compile_patterns(settings.get_strv(KEY_ERROR_PATTERNS), settings.get_strv(KEY_WARNING_PATTERNS))
+            self.log = joblog.JobLog(self.repo.dir, JOB_NAMES[self.type], settings.get_int(KEY_LOG_RETENTION), patterns)
+            self.log.write("$ %s\n" % cmd)
+        except (IOError, OSError), detail:
+            print "Could not create job log for %s: %s" % (self.repo.name, detail)
+            self.log = None
+
+    def get_profile(self):
+        settings = Gio.Settings.new(SCHEMA)
+        profiles = jobprofile.parse_profiles(settings.get_strv(KEY_JOB_PROFILES))
+        return profiles.get(JOB_NAMES[self.type])
+
+    def start_process(self, cmd, env=None):
+        if self.log is None:
+            self.open_log(cmd)
+        profile = self.get_profile()
+
+        def setup_child():
+            os.setsid()
+            if profile is not None:
+                profile.apply()
+
+        self.started = time.time()
+        self.process = subprocess.Popen(cmd, cwd=self.repo.dir, env=env, stdout=subprocess.PIPE, stderr=STDOUT, shell=True, preexec_fn=setup_child)
+        # Output is drained in bulk, so reads must never block the main loop
+        fd = self.process.stdout.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        GLib.io_add_watch(self.process.stdout,
+                          GLib.IO_IN | GLib.IO_HUP,
+                          self.output_callback,
+                          self)
 
     def clean(self):
-        self.repo.state[0] = STATE_CLEANING
+        self.state = STATE_CLEANING
+        if self.trash_reaper is not None and self.fast_clean():
+            return
         cmd = "git clean -fdx"
-        self.process = subprocess.Popen(cmd, cwd=self.repo.dir, stdout=subprocess.PIPE, stderr=STDOUT, shell=True, preexec_fn=os.setsid)
-        GLib.io_add_watch(self.process.stdout,
-                          GLib.IO_IN,
-                          self.output_callback)
+        self.start_process(cmd)
+
+    def fast_clean(self):
+        # Renames only - the trash reaper does the slow part later
+        paths = trash.list_untracked(self.repo.dir)
+        trash_root = trash.get_trash_root(self.repo.dir)
+        if paths is None or trash_root is None:
+            return False
+        if paths:
+            try:
+                batch, failed = trash.move_to_trash(self.repo.dir, paths, trash_root)
+            except OSError, detail:
+                print "Could not move files to %s, falling back to git clean: %s" % (trash_root, detail)
+                return False
+            trash.remove_now(self.repo.dir, failed)
+            self.trash_reaper.add(batch)
+        self.trashed = len(paths)
+        return True
 
     def reset(self):
-        self.repo.state[0] = STATE_RESETTING
+        self.state = STATE_RESETTING
         cmd = "git reset --hard"
-        self.process = subprocess.Popen(cmd, cwd=self.repo.dir, stdout=subprocess.PIPE, stderr=STDOUT, shell=True, preexec_fn=os.setsid)
-        GLib.io_add_watch(self.process.stdout,
-                          GLib.IO_IN,
-                          self.output_callback)
+        self.start_process(cmd)
 
     def rebase(self):
-        self.repo.state[0] = STATE_REBASING
-        cmd = "git pull --rebase %s %s" % (self.repo.upstream_remote, self.repo.upstream_branch)
+        self.state = STATE_REBASING
+        if self.local:
+            # Upstream was already fetched - nothing to do unless it moved past us
+            if util.run_git(self.repo.dir, ["merge-base", "--is-ancestor", self.repo.get_upstream_ref(), "HEAD"]) is not None:
+                self.up_to_date = True
+                return
+            cmd = "git rebase %s" % self.repo.get_upstream_ref()
+        else:
+            cmd = "git pull --rebase %s %s" % (self.repo.upstream_remote, self.repo.upstream_branch)
 
-        self.process = subprocess.Popen(cmd, cwd=self.repo.dir, stdout=subprocess.PIPE, stderr=STDOUT, shell=True, preexec_fn=os.setsid)
-        GLib.io_add_watch(self.process.stdout,
-                          GLib.IO_IN,
-                          self.output_callback)
+        self.start_process(cmd)
+
+    def fetch(self):
+        self.state = STATE_FETCHING
+        cmd = "git fetch %s +refs/heads/%s:%s" % (self.repo.upstream_remote, self.repo.upstream_branch, self.repo.get_upstream_ref())
+
+        env = dict(os.environ)
+        if "GIT_SSH" not in env and "GIT_SSH_COMMAND" not in env:
+            # Fetches from the same host share one multiplexed ssh connection
+            control_dir = os.path.join(GLib.get_user_cache_dir(), "git-monkey", "ssh")
+            if not os.path.isdir(control_dir):
+                os.makedirs(control_dir, 0700)
+            env["GIT_SSH_COMMAND"] = "ssh -o ControlMaster=auto -o ControlPersist=60 -o ControlPath=%s/%%C" % control_dir
+        self.start_process(cmd, env)
 
     def build(self):
-        self.repo.state[0] = STATE_BUILDING
+        self.state = STATE_BUILDING
 
         settings = Gio.Settings.new(SCHEMA)
-        cmd = settings.get_string(KEY_BUILD)
-
-        self.process = subprocess.Popen(cmd, shell=True, cwd=self.repo.dir, stdout = subprocess.PIPE, stderr = STDOUT, preexec_fn=os.setsid)
-        GLib.io_add_watch(self.process.stdout,
-                          GLib.IO_IN,
-                          self.output_callback)
+        self.build_command = settings.get_string(KEY_BUILD)
+        if self.isolated:
+            self.work_dir = worktree.get_worktree_dir(self.worktree_root, self.repo.dir)
+        # Fingerprinting a big tree takes a while - the build starts once it's done
+        self.preparing = True
+        self.background.run_in_background(self.prepare_build, (), self.on_build_prepared)
+
+    def prepare_build(self):
+        # Runs on a worker thread
+        commit = None
+        if self.isolated:
+            # Pin the build to what's committed now - the main checkout is free to move on
+            commit = (util.run_git(self.repo.dir, ["rev-parse", "HEAD"]) or "HEAD").strip()
+            self.fingerprint = buildstamp.get_commit_fingerprint(self.repo.dir, commit, self.build_command)
+        elif self.build_stamps is not None:
+            # Taken before the build starts, so an edit made while it runs is never stamped as built
+            self.fingerprint = buildstamp.get_fingerprint(self.repo.dir, self.build_command)
+        if self.build_stamps is not None and not self.force:
+            self.up_to_date = self.build_stamps.is_up_to_date(self.work_dir, self.fingerprint)
+        if self.artifact_cache is not None and not self.up_to_date:
+            self.artifact_tree = self.artifact_cache.get_tree(self.repo.dir, commit)
+            if self.artifact_tree is not None:
+                self.artifact_key = self.artifact_cache.get_key(self.artifact_tree, self.build_command)
+                if not self.force and self.artifact_cache.restore(self.artifact_key, self.get_output_dir()) is not None:
+                    self.restored = True
+                else:
+                    self.artifact_snapshot = artifactcache.snapshot_dir(self.get_build_output_dir())
+        return commit
+
+    def on_build_prepared(self, commit):
+        self.preparing = False
+        if not self.aborted and not self.up_to_date and not self.restored:
+            self.start_build(commit)
+        self.prepared_callback(self)
+
+    def start_build(self, commit):
+        cmd = self.build_command
+        self.open_log(cmd)
+        env = self.get_build_env(Gio.Settings.new(SCHEMA))
+        if self.isolated:
+            cmd = "%s && cd %s && %s" % (worktree.get_prepare_cmd(self.work_dir, commit), pipes.quote(self.work_dir), cmd)
+            self.output_snapshot = artifactcache.snapshot_dir(self.get_build_output_dir())
+        self.start_process(cmd, env)
+
+    def get_build_env(self, settings):
+        env = os.environ
+        if settings.get_boolean(KEY_COMPILER_CACHE):
+            cache_dir = settings.get_string(KEY_COMPILER_CACHE_DIR)
+            if cache_dir == "":
+                cache_dir = os.path.join(GLib.get_user_cache_dir(), "git-monkey", "ccache")
+            stats_log = None
+            if self.log is not None:
+                stats_log = os.path.join(self.log.dir, buildenv.STATS_LOG_FILE)
+            env = buildenv.get_ccache_env(env, os.path.expanduser(cache_dir), settings.get_int(KEY_COMPILER_CACHE_SIZE),
+                                          self.get_build_output_dir(), stats_log)
+        if self.jobserver is not None:
+            env = self.jobserver.get_env(env)
+        else:
+            env = dict(env)
+            env["DEB_BUILD_OPTIONS"] = buildenv.set_parallel_option(env.get("DEB_BUILD_OPTIONS", ""), get_cpu_count() + 1)
+        return env
+
+    def finalize_build(self):
+        # Runs on a worker thread, after a successful build
+        fingerprint = None
+        if not self.isolated and (self.build_stamps is not None or self.artifact_snapshot is not None):
+            fingerprint = buildstamp.get_fingerprint(self.repo.dir, self.build_command)
+        if self.build_stamps is not None and not self.isolated:
+            # Stamp the tree as the build left it, but only if it's still what the build saw
+            if buildstamp.has_same_sources(self.fingerprint, fingerprint):
+                self.fingerprint = fingerprint
+            else:
+                self.fingerprint = None
+        if self.artifact_snapshot is not None and not self.isolated:
+            # The same goes for the cache - packages built while the tree was edited
+            # must not be filed under the clean tree's key
+            self.stale = fingerprint is None or fingerprint["tree"] != self.artifact_tree or fingerprint["dirty"] != buildstamp.CLEAN_DIFF
+        if self.artifact_snapshot is not None and not self.stale:
+            self.stored = self.artifact_cache.store(self.artifact_key, self.repo.dir, self.get_build_output_dir(), self.artifact_snapshot)
+        if self.isolated:
+            self.published = worktree.publish(self.repo.dir, self.get_build_output_dir(), self.get_output_dir(), self.output_snapshot)
+
+    def collect_ccache_stats(self):
+        if self.log is not None and self.process is not None:
+            self.ccache_stats = buildenv.read_stats_log(os.path.join(self.log.dir, buildenv.STATS_LOG_FILE))
+
+    def get_output_dir(self):
+        # dpkg-buildpackage puts its results next to the source dir
+        return os.path.dirname(os.path.normpath(self.repo.dir))
+
+    def get_build_output_dir(self):
+        return os.path.dirname(os.path.normpath(self.work_dir))
 
     def new_branch(self):
-        self.repo.state[0] = STATE_NEW_BRANCH_IN_PROGRESS
+        self.state = STATE_NEW_BRANCH_IN_PROGRESS
         cmd = "git checkout -b %s" % (self.new_branch_name)
-        self.process = subprocess.Popen(cmd, cwd=self.repo.dir, stdout=subprocess.PIPE, stderr=STDOUT, shell=True, preexec_fn=os.setsid)
-        GLib.io_add_watch(self.process.stdout,
-                          GLib.IO_IN,
-                          self.output_callback)
+        self.start_process(cmd)
         self.new_branch_name = ""
 
     def pull_request(self):
-        self.repo.state[0] = STATE_PULL_REQUEST_IN_PROGRESS
-        cmd = "git fetch %s refs/pull/%s/head:%s && git checkout %s" % (self.repo.upstream_remote, self.new_branch_name, self.new_branch_name, self.new_branch_name)
-        self.process = subprocess.Popen(cmd, cwd=self.repo.dir, stdout=subprocess.PIPE, stderr=STDOUT, shell=True, preexec_fn=os.setsid)
-        GLib.io_add_watch(self.process.stdout,
-                          GLib.IO_IN,
-                          self.output_callback)
-        self.new_branch_name = ""
+        self.state = STATE_PULL_REQUEST_IN_PROGRESS
+        numbers = self.pr_numbers
+        if not self.force:
+            cached = prcache.list_cached(self.repo.dir)
+            numbers = [number for number in numbers if number not in cached]
+
+        cmds = []
+        if numbers:
+            # One negotiation for every pull request that isn't cached yet
+            cmds.append("git fetch %s %s" % (self.repo.upstream_remote, " ".join(prcache.get_fetch_refspecs(numbers))))
+
+        # Branches are created (or fast-forwarded) from the cache - git won't update the checked out one that way
+        current = self.repo.get_branch_name()
+        refspecs = ["%s:refs/heads/%d" % (prcache.get_cache_ref(number), number) for number in self.pr_numbers if str(number) != current]
+        if refspecs:
+            cmds.append("git fetch . %s" % " ".join(refspecs))
+        cmds.append("git checkout %d" % self.pr_numbers[0])
+
+        self.start_process(" && ".join(cmds))
 
 class JobManager:
-    def __init__(self, model):
-        self.jobs = []
-        self.busy = False
-        self.current_job = None
+    def __init__(self, model, started_callback=None, added_callback=None):
+        self.queue = jobqueue.JobQueue()
+        self.running = []
+        self.throttled = set()
         self.model = model
-        GObject.timeout_add(500, self.process_next_job)
+        self.started_callback = started_callback
+        self.added_callback = added_callback
+        self.settings = Gio.Settings.new(SCHEMA)
+        self.dispatch_id = 0
+        self.throttle_id = 0
+        self.pressure_cache = {}
+        self.history = None
+        self.maintainer = None
+        self.predictions = {}
+
+    def get_class_for_job(self, job):
+        if job.type == JOB_FETCH:
+            return JOB_CLASS_FETCH
+        elif job.type == JOB_REBASE and job.local:
+            return JOB_CLASS_DISK
+        elif job.type in (JOB_REBASE, JOB_CHECKOUT_PR):
+            return JOB_CLASS_NETWORK
+        elif job.type == JOB_BUILD:
+            return JOB_CLASS_CPU
+        else:
+            return JOB_CLASS_DISK
+
+    def get_limit_for_class(self, job_class):
+        if job_class == JOB_CLASS_NETWORK:
+            limit = self.settings.get_int(KEY_MAX_NETWORK_JOBS)
+        elif job_class == JOB_CLASS_FETCH:
+            limit = self.settings.get_int(KEY_MAX_FETCH_JOBS)
+        elif job_class == JOB_CLASS_CPU:
+            limit = self.settings.get_int(KEY_MAX_BUILD_JOBS)
+        else:
+            limit = self.settings.get_int(KEY_MAX_DISK_JOBS)
+        return max(1, limit)
+
+    def get_max_jobs(self):
+        limit = self.settings.get_int(KEY_MAX_JOBS)
+        if limit <= 0:
+            limit = get_cpu_count()
+        return max(1, limit)
+
+    def is_building(self):
+        for job in self.running:
+            if job.type == JOB_BUILD:
+                return True
+        return False
+
+    def is_checkout_busy(self, repo):
+        for job in self.get_jobs_for_repo(repo):
+            if job.uses_checkout():
+                return True
+        return False
 
-    def kill_current_process(self):
-        if self.current_job.process:
-            os.killpg(self.current_job.process.pid, signal.SIGTERM)
-            self.current_job.aborted = True
+    def has_jobs(self, repo):
+        if self.queue.has_repo(repo):
+            return True
+        for job in self.running:
+            if job.repo == repo:
+                return True
+        return False
 
-    def clear_job_queue_by_list(self, job_list):
-        for job in job_list:
+    def is_busy(self):
+        return len(self.queue) > 0 or len(self.running) > 0
+
+    def kill_process(self, job):
+        if job.process:
+            try:
+                os.killpg(job.process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+        job.aborted = True
+
+    def abort_queued(self, jobs):
+        for job in jobs:
             job.aborted = True
-            self.jobs.remove(job)
+            self.throttled.discard(job)
 
     def find_and_abort(self, repo):
-        if self.current_job != None:
-            if self.current_job.repo == repo:
-                self.kill_current_process()
-        to_abort = []
-        for job in self.jobs:
+        for job in self.running:
             if job.repo == repo:
-                to_abort.append(job)
-        self.clear_job_queue_by_list(to_abort)
-        repo.state = []
+                self.kill_process(job)
+        self.abort_queued(self.queue.remove_repo(repo))
         repo.last_finished_state = STATE_ABORTED
+        self.refresh_rows()
 
     def abort_all_jobs(self):
-        if self.current_job != None:
-            self.kill_current_process()
-        to_abort = []
-        for job in self.jobs:
-            to_abort.append(job)
-        self.clear_job_queue_by_list(to_abort)
+        for job in self.running:
+            self.kill_process(job)
+        self.abort_queued(self.queue.clear())
+        self.refresh_rows()
 
     def add_job(self, job):
-        self.jobs.append(job)
+        job.estimate = self.get_estimate(job)
+        self.queue.push(job)
+        if self.added_callback is not None:
+            self.added_callback(job)
+        self.queue_dispatch()
+
+    def queue_dispatch(self):
+        # Coalesce bursts of queued jobs and exits into a single dispatch pass
+        if self.dispatch_id == 0:
+            self.dispatch_id = GLib.idle_add(self.process_next_job)
+
+    def can_run_job(self, job, busy_repos, building_repos, class_counts, is_done):
+        # Jobs for a single repo always start in the order they were queued
+        if job.repo in busy_repos:
+            return False
+        # An isolated build only keeps other builds of its repo waiting (they share its worktree)
+        if job.type == JOB_BUILD and job.repo in building_repos:
+            return False
+        for dependency in job.depends_on:
+            if not is_done(dependency):
+                return False
+        job_class = self.get_class_for_job(job)
+        return class_counts.get(job_class, 0) < self.get_limit_for_class(job_class)
+
+    def get_throttle_reason(self, job_class):
+        # Sampled once per dispatch pass - the files don't change that fast
+        if job_class not in self.pressure_cache:
+            self.pressure_cache[job_class] = self.read_throttle_reason(job_class)
+        return self.pressure_cache[job_class]
+
+    def read_throttle_reason(self, job_class):
+        if job_class in (JOB_CLASS_NETWORK, JOB_CLASS_FETCH):
+            return None
+        memory = pressure.read_pressure("memory")
+        if pressure.over(memory, self.settings.get_double(KEY_THROTTLE_MEMORY_PRESSURE)):
+            return "memory pressure %.0f%%" % memory
+        if job_class == JOB_CLASS_CPU:
+            cpu = pressure.read_pressure("cpu")
+            if pressure.over(cpu, self.settings.get_double(KEY_THROTTLE_CPU_PRESSURE)):
+                return "CPU pressure %.0f%%" % cpu
+            load = pressure.read_loadavg()
+            if load is not None and pressure.over(load / get_cpu_count(), self.settings.get_double(KEY_THROTTLE_LOAD)):
+                return "load %.1f" % load
+        else:
+            io = pressure.read_pressure("io")
+            if pressure.over(io, self.settings.get_double(KEY_THROTTLE_IO_PRESSURE)):
+                return "I/O pressure %.0f%%" % io
+        return None
+
+    def set_throttled(self, job, reason):
+        if not job.throttled:
+            job.throttled = True
+            job.queued_state = job.state
+            job.state = STATE_THROTTLED
+            self.throttled.add(job)
+        job.repo.throttle_reason = reason
+
+    def clear_throttled(self, job):
+        if job.throttled:
+            job.throttled = False
+            job.state = job.queued_state
+            job.repo.throttle_reason = None
+            self.throttled.discard(job)
+
+    def has_failed_dependency(self, job):
+        for dependency in job.depends_on:
+            if dependency.aborted or dependency.skipped or (dependency.finished and not dependency.succeeded()):
+                return True
+        return False
+
+    def skip_job(self, job):
+        job.skipped = True
+        self.queue.pop(job)
+        GObject.idle_add(job.finished_callback, job)
+
+    def get_estimate(self, job):
+        if self.history is None:
+            return None
+        return self.history.estimate(job.repo.dir, JOB_NAMES[job.type])
+
+    def get_candidates(self, queue, running, is_done):
+        busy_repos = set()
+        building_repos = set()
+        class_counts = {}
+        for job in running:
+            if job.uses_checkout():
+                busy_repos.add(job.repo)
+            else:
+                building_repos.add(job.repo)
+            job_class = self.get_class_for_job(job)
+            class_counts[job_class] = class_counts.get(job_class, 0) + 1
+
+        candidates = []
+        for job in queue.get_heads():
+            if self.can_run_job(job, busy_repos, building_repos, class_counts, is_done):
+                candidates.append(job)
+
+        # Repos with a single-repo action queued go first, so it isn't stuck behind
+        # bulk "all" work. Then longest first, so a slow repo doesn't start last and
+        # stretch the whole run - a candidate is the head of its repo's queue, so it's
+        # ranked by all the work queued for that repo. The sort is stable, so repos
+        # that are otherwise equal keep their queue order.
+        candidates.sort(key=lambda job: (not queue.has_interactive(job.repo), -queue.get_work(job.repo)))
+        return candidates
 
     def get_job_from_stack(self):
-        job = get_first(self.jobs)
-        if job:
-            self.jobs.remove(job)
-        return job
+        if len(self.running) >= self.get_max_jobs():
+            return None
+
+        busy_repos = set([job.repo for job in self.running if job.uses_checkout()])
+        for job in self.queue.get_heads():
+            # No point building against something that didn't build - skipping a
+            # head uncovers the repo's next job, which may need skipping too
+            while job is not None and job.repo not in busy_repos and self.has_failed_dependency(job):
+                self.skip_job(job)
+                job = self.queue.get_head(job.repo)
+
+        for job in self.get_candidates(self.queue, self.running, lambda job: job.succeeded()):
+            if self.maintainer is not None and self.maintainer.current == job.repo.dir:
+                # Maintenance there was told to stop - wait until git has let go of the repo's locks
+                continue
+            reason = self.get_throttle_reason(self.get_class_for_job(job))
+            if reason is None:
+                self.queue.pop(job)
+                return job
+            self.set_throttled(job, reason)
+        return None
+
+    def predict(self):
+        # Replays the dispatcher on estimated durations (ignoring throttling) to
+        # get each job's expected finish time. Jobs with no history count as instant.
+        clock = time.time()
+        self.predictions = {}
+        running = []
+        for job in self.running:
+            elapsed = clock - (job.started or clock)
+            running.append((clock + max(0, (job.estimate or 0) - elapsed), job))
+        pending = self.queue.copy()
+        is_done = lambda job: job.succeeded() or job in self.predictions
+        max_jobs = self.get_max_jobs()
+        while True:
+            while len(pending) > 0 and len(running) < max_jobs:
+                candidates = self.get_candidates(pending, [job for end, job in running], is_done)
+                if not candidates:
+                    break
+                pending.pop(candidates[0])
+                running.append((clock + (candidates[0].estimate or 0), candidates[0]))
+            if not running:
+                # Anything still pending is behind a failed dependency
+                break
+            running.sort(key=lambda item: item[0])
+            end, job = running.pop(0)
+            clock = max(clock, end)
+            self.predictions[job] = end
+
+    def get_queue_end(self):
+        if not self.predictions:
+            return None
+        return max(self.predictions.values())
+
+    def get_jobs_for_repo(self, repo):
+        return [job for job in self.running if job.repo == repo] + self.queue.get_jobs(repo)
 
     def model_signal_update(self, model, path, row_iter, data):
         self.model.row_changed(path, row_iter)
 
-    def process_next_job(self):
+    def refresh_rows(self):
         self.model.foreach(self.model_signal_update, None)
-        if self.busy:
-            self.current_job.process.poll()
-            if self.current_job.process.returncode is None:
-                return True
-            else:
-                self.busy = False
-                GObject.idle_add(self.current_job.finished_callback, self.current_job)
-                self.current_job = None
+
+    def on_child_exited(self, status, rusage, job):
+        if status is None:
+            # Somebody else reaped it - the exit status and usage are gone
+            job.process.returncode = -1
+        elif os.WIFSIGNALED(status):
+            job.process.returncode = -os.WTERMSIG(status)
+        else:
+            job.process.returncode = os.WEXITSTATUS(status)
+        job.usage = jobstats.get_usage(rusage, job.started, job.process.returncode)
+        if job.type == JOB_BUILD and job.process.returncode == 0 and not job.aborted:
+            # The repo stays busy until the build's results are dealt with
+            job.background.run_in_background(job.finalize_build, (), lambda result: self.finish_job(job))
+            return
+        self.finish_job(job)
+
+    def finish_job(self, job):
+        job.finished = True
+        if job in self.running:
+            self.running.remove(job)
+        GObject.idle_add(job.finished_callback, job)
+        self.queue_dispatch()
+
+    def process_next_job(self):
+        self.dispatch_id = 0
+        self.pressure_cache = {}
+        for job in list(self.throttled):
+            self.clear_throttled(job)
         job = self.get_job_from_stack()
-        if job:
-            self.current_job = job
+        while job:
+            self.running.append(job)
+            job.prepared_callback = self.on_job_prepared
             self.do_job_work(job)
-        return True
+            if not job.preparing:
+                self.on_job_prepared(job)
+            job = self.get_job_from_stack()
+        if self.throttle_id == 0 and self.throttled:
+            self.throttle_id = GLib.timeout_add_seconds(THROTTLE_RECHECK_INTERVAL, self.on_throttle_recheck)
+        self.refresh_rows()
+        return False
+
+    def on_job_prepared(self, job):
+        if job.process is None:
+            # Nothing needed running (e.g. an up to date build)
+            self.finish_job(job)
+        else:
+            childwatch.watch(job.process.pid, self.on_child_exited, job)
+            # Jobs held back while the main checkout was in use may go now
+            self.queue_dispatch()
+        if self.started_callback is not None:
+            self.started_callback(job)
+
+    def on_throttle_recheck(self):
+        self.throttle_id = 0
+        self.queue_dispatch()
+        return False
 
     def do_job_work(self, job):
-        self.busy = True
         if job.type == JOB_CLEAN:
             job.clean()
         elif job.type == JOB_RESET:
@@ -187,6 +711,8 @@ class JobManager:
             job.new_branch()
         elif job.type == JOB_CHECKOUT_PR:
             job.pull_request()
+        elif job.type == JOB_FETCH:
+            job.fetch()
 
 class Main:
     def __init__(self):
@@ -218,6 +744,12 @@ class Main:
         self.full_build_button = self.builder.get_object("build")
         self.output_scroller = self.builder.get_object("scroller")
         self.output = self.builder.get_object("output_view")
+        self.log_combo = self.builder.get_object("log_combo")
+        self.log_older_button = self.builder.get_object("log_older")
+        self.log_newer_button = self.builder.get_object("log_newer")
+        self.log_prev_issue_button = self.builder.get_object("log_prev_issue")
+        self.log_next_issue_button = self.builder.get_object("log_next_issue")
+        self.log_issue_label = self.builder.get_object("log_issue_label")
         self.new_branch = self.builder.get_object("new_branch")
         self.pull_request_button = self.builder.get_object("pull_request")
         self.master_button = self.builder.get_object("master")
@@ -231,7 +763,39 @@ class Main:
         self.combo_model = Gtk.ListStore(str, str)
 
         self.busy = False
-        self.job_manager = JobManager(self.model)
+        self.pending_output = []
+        self.partial_output = {}
+        self.output_flush_id = 0
+        self.job_manager = JobManager(self.model, self.job_started_callback, self.job_added_callback)
+        self.jobserver = None
+        self.build_stamps = buildstamp.BuildStamps(os.path.join(GLib.get_user_cache_dir(), "git-monkey", "build-stamps.json"))
+        self.artifact_cache = artifactcache.ArtifactCache(os.path.join(GLib.get_user_cache_dir(), "git-monkey", "artifacts"),
+                                                          self.settings.get_int(KEY_ARTIFACT_CACHE_SIZE) * 1024 * 1024)
+        self.status_cache = None
+        if self.settings.get_boolean(KEY_STATUS_CACHE):
+            self.status_cache = repostatus.StatusCache(os.path.join(GLib.get_user_cache_dir(), "git-monkey", "status-cache.json"))
+        self.status_refresher = repostatus.StatusRefresher(self.settings.get_int(KEY_STATUS_WORKERS), self.on_repo_status_updated, self.status_cache)
+        self.repo_watcher = repowatch.RepoWatcher(self.settings.get_int(KEY_WATCH_DEBOUNCE), self.on_repos_changed_on_disk)
+        self.recent_pull_requests = prcache.RecentPullRequests(os.path.join(GLib.get_user_cache_dir(), "git-monkey", "recent-pull-requests.json"))
+        self.upstream_monitor = None
+        if self.settings.get_int(KEY_DRIFT_INTERVAL) > 0:
+            self.upstream_monitor = upstream.UpstreamMonitor(self.settings.get_int(KEY_DRIFT_WORKERS),
+                                                             self.settings.get_int(KEY_DRIFT_INTERVAL), self.on_repo_drift_updated)
+            GLib.timeout_add_seconds(self.settings.get_int(KEY_DRIFT_INTERVAL), self.on_drift_timeout)
+        self.maintainer = None
+        if self.settings.get_int(KEY_MAINTENANCE_INTERVAL) > 0:
+            self.maintainer = maintenance.Maintainer(os.path.join(GLib.get_user_cache_dir(), "git-monkey", "maintenance.json"),
+                                                     self.settings.get_int(KEY_MAINTENANCE_INTERVAL) * 3600, self.on_maintenance_finished)
+            GLib.timeout_add_seconds(MAINTENANCE_CHECK_INTERVAL, self.on_maintenance_timeout)
+        self.job_manager.maintainer = self.maintainer
+        self.trash_reaper = trash.TrashReaper()
+        self.job_history = jobstats.JobHistory(os.path.join(GLib.get_user_cache_dir(), "git-monkey", "job-history.json"))
+        self.job_manager.history = self.job_history
+        self.eta_id = 0
+        self.pr_prefetcher = None
+        if self.settings.get_int(KEY_PR_PREFETCH_INTERVAL) > 0:
+            self.pr_prefetcher = prcache.PullRequestPrefetcher()
+            GLib.timeout_add_seconds(self.settings.get_int(KEY_PR_PREFETCH_INTERVAL) * 60, self.on_pr_prefetch_timeout)
 
         color = Gdk.RGBA()
         Gdk.RGBA.parse(color, "black")
@@ -246,6 +810,24 @@ class Main:
         self.branch_combo = self.builder.get_object("branch_combo")
         self.branch_combo_changed_id = self.branch_combo.connect ("changed", self.on_branch_combo_changed)
 
+        self.live_buffer = self.output.get_buffer()
+        self.log_buffer = Gtk.TextBuffer()
+        self.log_buffer.create_tag("issue", background="#444400")
+        self.log_path = None
+        self.log_issues = []
+        self.log_issue_pos = -1
+        self.log_index_end = 0
+        self.log_start = 0
+        self.log_end = 0
+        self.log_follow = True
+        self.log_model = Gtk.ListStore(str, str)
+        self.log_combo.set_model(self.log_model)
+        cell = Gtk.CellRendererText()
+        self.log_combo.pack_start(cell, True)
+        self.log_combo.add_attribute(cell, "text", 0)
+        self.log_combo_changed_id = self.log_combo.connect("changed", self.on_log_combo_changed)
+        self.update_log_combo(None)
+
         self.builder.connect_signals(self)
 
         cell = Gtk.CellRendererPixbuf()
@@ -267,6 +849,11 @@ class Main:
         column = Gtk.TreeViewColumn("Default Upstream", Gtk.CellRendererText(), markup=4)
         column.set_sort_column_id(4)
         self.treeview.append_column(column)
+        if self.upstream_monitor is not None:
+            cell = Gtk.CellRendererText()
+            column = Gtk.TreeViewColumn("Ahead/Behind", cell)
+            column.set_cell_data_func(cell, self.drift_func)
+            self.treeview.append_column(column)
         column = Gtk.TreeViewColumn("Status", Gtk.CellRendererText(), markup=3)
         column.set_sort_column_id(3)
         column.set_min_width(200)
@@ -276,6 +863,7 @@ class Main:
         column.set_cell_data_func(cell, self.current_activity_func)
         column.set_min_width(300)
         self.treeview.append_column(column)
+        self.queue_column = column
         cell = Gtk.CellRendererText()
         column = Gtk.TreeViewColumn("Last Job", cell)
         column.set_cell_data_func(cell, self.past_activity_func)
@@ -322,6 +910,14 @@ class Main:
             text = "Building..."
         elif state == STATE_BUILT:
             text = "Build finished"
+        elif state == STATE_BUILD_FAILED:
+            text = "Build failed"
+        elif state == STATE_UP_TO_DATE:
+            text = "Up to date"
+        elif state == STATE_RESTORED:
+            text = "Restored from cache"
+        elif state == STATE_THROTTLED:
+            text = "Throttled"
 
         elif state == STATE_REBASE_QUEUED:
             text = "Rebase queued"
@@ -329,6 +925,17 @@ class Main:
             text = "Rebasing..."
         elif state == STATE_REBASED:
             text = "Rebased"
+        elif state == STATE_REBASE_FAILED:
+            text = "Rebase failed"
+
+        elif state == STATE_FETCH_QUEUED:
+            text = "Fetch queued"
+        elif state == STATE_FETCHING:
+            text = "Fetching..."
+        elif state == STATE_FETCHED:
+            text = "Fetched"
+        elif state == STATE_FETCH_FAILED:
+            text = "Fetch failed"
 
         elif state == STATE_CLEAN_QUEUED:
             text = "Clean queued"
@@ -360,6 +967,8 @@ class Main:
 
         elif state == STATE_ABORTED:
             text = "Aborted"
+        elif state == STATE_SKIPPED:
+            text = "Skipped (a dependency failed)"
 
         return text
 
@@ -368,23 +977,103 @@ class Main:
 
         string = ""
         first = True
+        now = time.time()
 
-        for state in repo.state:
+        for job in self.job_manager.get_jobs_for_repo(repo):
             if not first:
                 string += ", "
-            string += self.get_string_for_state(state)
+            if job.state == STATE_THROTTLED and repo.throttle_reason is not None:
+                string += "Throttled (%s)" % repo.throttle_reason
+            else:
+                string += self.get_string_for_state(job.state)
+            if job in self.job_manager.predictions and job.estimate is not None:
+                string += " (done in ~%s)" % self.get_string_for_duration(max(0, self.job_manager.predictions[job] - now))
             first = False
 
         cell.set_property("text", string)
 
+    def queue_eta_refresh(self):
+        if self.eta_id == 0:
+            self.update_eta()
+            self.eta_id = GLib.timeout_add_seconds(ETA_REFRESH_INTERVAL, self.on_eta_timeout)
+
+    def on_eta_timeout(self):
+        self.update_eta()
+        if not self.job_manager.is_busy():
+            self.eta_id = 0
+            return False
+        return True
+
+    def update_eta(self):
+        self.job_manager.predict()
+        end = self.job_manager.get_queue_end()
+        if end is not None and end > time.time():
+            self.queue_column.set_title("Job Queue (all done in ~%s)" % self.get_string_for_duration(end - time.time()))
+        else:
+            self.queue_column.set_title("Job Queue")
+        self.job_manager.refresh_rows()
+
+    def get_string_for_issues(self, errors, warnings):
+        parts = []
+        if errors > 0:
+            parts.append("%d error%s" % (errors, "s" if errors != 1 else ""))
+        if warnings > 0:
+            parts.append("%d warning%s" % (warnings, "s" if warnings != 1 else ""))
+        return ", ".join(parts)
+
     def past_activity_func(self, column, cell, model, iter, data=None):
         repo = model.get_value(iter, 0)
 
-        cell.set_property("text", self.get_string_for_state(repo.last_finished_state))
+        text = self.get_string_for_state(repo.last_finished_state)
+        if repo.last_job_log is not None and repo.last_finished_state not in (STATE_NONE, STATE_ABORTED):
+            issues = self.get_string_for_issues(repo.last_job_log.errors, repo.last_job_log.warnings)
+            if issues != "":
+                text += " (%s)" % issues
+        if repo.last_ccache_stats is not None and repo.last_finished_state in (STATE_BUILT, STATE_BUILD_FAILED):
+            text += " [%s]" % self.get_string_for_ccache_stats(repo.last_ccache_stats)
+        if repo.last_job_usage is not None and repo.last_finished_state not in (STATE_NONE, STATE_ABORTED):
+            text += " - %s" % self.get_string_for_usage(repo.last_job_usage)
+        cell.set_property("text", text)
+
+    def get_string_for_duration(self, seconds):
+        if seconds < 60:
+            return "%.1fs" % seconds
+        return "%dm%02ds" % (seconds / 60, seconds % 60)
+
+    def get_string_for_usage(self, usage):
+        text = self.get_string_for_duration(usage["wall"])
+        if "user" in usage:
+            text += ", CPU %s, %d MB" % (self.get_string_for_duration(usage["user"] + usage["sys"]), usage["max_rss_kb"] / 1024)
+        return text
+
+    def get_string_for_ccache_stats(self, stats):
+        hits, misses = stats
+        total = hits + misses
+        if total == 0:
+            return "ccache: no compilations"
+        return "ccache: %d%% hits (%d/%d)" % (hits * 100 / total, hits, total)
+
+    def drift_func(self, column, cell, model, iter, data=None):
+        repo = model.get_value(iter, 0)
+        cell.set_property("markup", self.get_string_for_drift(repo.drift))
+
+    def get_string_for_drift(self, drift):
+        if drift is None:
+            return ""
+        elif drift.error is not None:
+            return "<span color='#DF0101'>Unreachable</span>"
+        elif not drift.fetched:
+            return "<b><span color='#DF0101'>Behind (not fetched)</span></b>"
+        elif drift.ahead == 0 and drift.behind == 0:
+            return "<span color='#01DF01'>Up to date</span>"
+        elif drift.behind == 0:
+            return "%d ahead" % drift.ahead
+        else:
+            return "<b><span color='#DF0101'>%d ahead, %d behind</span></b>" % (drift.ahead, drift.behind)
 
     def abort_func(self, column, cell, model, iter, data=None):
         repo = model.get_value(iter, 0)
-        if len(repo.state) == 0:
+        if not self.job_manager.has_jobs(repo):
             cell.set_property("stock-id", "")
         else:
             cell.set_property("stock-id", "gtk-no")
@@ -401,11 +1090,14 @@ class Main:
                 elif event.type == Gdk.EventType._2BUTTON_PRESS:
                     iter = self.model.get_iter(path)
                     repo = self.model.get_value(iter, 0)
-                    if len(repo.state) == 0:
+                    if not self.job_manager.has_jobs(repo):
                         repoedit.EditRepo(repo.dir, repo.upstream_remote, repo.upstream_branch, repo.push_remote)
 
     def parse_dirs(self):
+        self.status_refresher.cancel_all()
+        self.repo_watcher.unwatch_all()
         self.model.clear()
+        repos_to_check = []
         repos = self.settings.get_strv(KEY_REPOS)
 
         for repo in repos:
@@ -426,14 +1118,35 @@ class Main:
             else:
                 pr = push_remote
             repo = GitRepo(d, remote, remote_branch, pr)
+            last_known = None
+            if self.status_cache is not None:
+                last_known = self.status_cache.get_last_known(repo.dir)
 
             iter = self.model.insert_before(None, None)
             self.model.set_value(iter, 0, repo)
             self.model.set_value(iter, 1, repo.name)
-            self.model.set_value(iter, 2, repo.head.reference.name)
-            self.model.set_value(iter, 3, self.grab_repo_status(repo))
+            if last_known is not None:
+                repo.status = last_known
+                self.model.set_value(iter, 2, repo.get_branch_name())
+                self.model.set_value(iter, 3, self.grab_repo_status(repo))
+            else:
+                self.model.set_value(iter, 2, "")
+                self.model.set_value(iter, 3, "<i>Checking...</i>")
             us_string = "%s/%s" % (repo.upstream_remote, repo.upstream_branch)
             self.model.set_value(iter, 4, us_string)
+            repos_to_check.append(repo)
+            if self.settings.get_boolean(KEY_WATCH_REPOS):
+                self.repo_watcher.watch(repo, self.settings.get_boolean(KEY_WATCH_WORKTREE))
+
+        # The cached status is only something to show meanwhile - its signature doesn't
+        # see edits below the top level, so it can't stand in for running git status
+        self.status_refresher.refresh(repos_to_check, force=True)
+        if self.settings.get_boolean(KEY_FAST_CLEAN):
+            for trash_root in set([trash.get_trash_root(repo.dir) for repo in repos_to_check]):
+                if trash_root is not None:
+                    self.trash_reaper.add_leftovers(trash_root)
+        if self.upstream_monitor is not None:
+            self.upstream_monitor.check(repos_to_check)
 
         self.clean_button.set_sensitive(False)
         self.reset_button.set_sensitive(False)
@@ -444,21 +1157,53 @@ class Main:
         self.branch_combo.set_sensitive(False)
         self.remove_repo_button.set_sensitive(False)
 
-    def update_repos(self):
+    def update_repo(self, repo):
+        self.status_refresher.refresh([repo], force=True)
+
+    def on_repos_changed_on_disk(self, repos):
+        # Repos with jobs in flight get refreshed when their job finishes
+        idle = [repo for repo in repos if not self.job_manager.has_jobs(repo)]
+        self.status_refresher.refresh(idle, force=True)
+
+    def on_drift_timeout(self):
+        self.upstream_monitor.check(self.get_all_repos())
+        return True
+
+    def on_repo_drift_updated(self, repo):
+        row_iter = self.find_row_for_repo(repo)
+        if row_iter is not None:
+            self.model.row_changed(self.model.get_path(row_iter), row_iter)
+
+    def find_row_for_repo(self, repo):
         row_iter = self.model.get_iter_first()
         while row_iter != None:
-            repo = self.model.get_value(row_iter, 0)
-            self.model.set_value(row_iter, 2, repo.head.reference.name)
-            self.model.set_value(row_iter, 3, self.grab_repo_status(repo))
+            if self.model.get_value(row_iter, 0) == repo:
+                return row_iter
             row_iter = self.model.iter_next(row_iter)
-        self.clean_button.set_sensitive(len(self.current_repo.untracked_files) != 0)
-        self.reset_button.set_sensitive(self.current_repo.is_dirty())
-        self.master_button.set_sensitive(self.current_repo.head.reference.name != self.current_repo.upstream_branch)
+        return None
 
+    def on_repo_status_updated(self, repo):
+        row_iter = self.find_row_for_repo(repo)
+        if row_iter is None:
+            return
+        self.model.set_value(row_iter, 2, repo.get_branch_name())
+        self.model.set_value(row_iter, 3, self.grab_repo_status(repo))
+        if self.status_cache is not None:
+            self.refresh_button.set_tooltip_text("Status cache: %d hits, %d misses" % (self.status_cache.hits, self.status_cache.misses))
+        if repo == self.current_repo:
+            self.update_buttons_for_status(repo)
+            self.update_branch_combo(repo)
+
+    def update_buttons_for_status(self, repo):
+        self.clean_button.set_sensitive(repo.status.has_untracked())
+        self.reset_button.set_sensitive(repo.status.is_dirty())
+        self.master_button.set_sensitive(not self.job_manager.is_checkout_busy(repo) and repo.status.branch != repo.upstream_branch)
 
     def grab_repo_status(self, repo):
-        untracked = len(repo.untracked_files) != 0
-        dirty = repo.is_dirty()
+        if not repo.status.valid:
+            return "<b><span color='#DF0101'>Unknown</span></b>"
+        untracked = repo.status.has_untracked()
+        dirty = repo.status.is_dirty()
         if not untracked and not dirty:
             return "<b><span color='#01DF01'>Clean</span></b>"
         elif untracked and dirty:
@@ -475,7 +1220,7 @@ class Main:
             iter = self.combo_model.insert_before(None, None)
             self.combo_model.set_value(iter, 0, head.name)
             self.combo_model.set_value(iter, 1, head.name)
-            if repo.head.reference.name == head.name:
+            if repo.status.branch == head.name:
                 current_iter = iter
         if current_iter is not None:
             self.branch_combo.handler_block(self.branch_combo_changed_id)
@@ -488,19 +1233,18 @@ class Main:
             repo = self.model.get_value(treeiter, 0)
             self.current_repo = repo
             self.update_branch_combo(repo)
-            self.clean_button.set_sensitive(len(repo.untracked_files) != 0)
-            self.reset_button.set_sensitive(repo.is_dirty())
+            self.update_log_combo(repo)
             self.term_button.set_sensitive(True)
             self.full_build_button.set_sensitive(True)
             self.new_branch.set_sensitive(True)
             self.rebase_button.set_sensitive(True)
             self.pull_request_button.set_sensitive(True)
-            no_active = len(repo.state) == 0
-            self.branch_combo.set_sensitive(no_active)
+            no_active = not self.job_manager.has_jobs(repo)
+            self.branch_combo.set_sensitive(not self.job_manager.is_checkout_busy(repo))
             self.remove_repo_button.set_sensitive(no_active)
             self.refresh_button.set_sensitive(no_active)
             self.add_repo_button.set_sensitive(no_active)
-            self.master_button.set_sensitive(no_active and repo.head.reference.name != repo.upstream_branch)
+            self.update_buttons_for_status(repo)
 
     def on_branch_combo_changed (self, widget):
         tree_iter = widget.get_active_iter()
@@ -508,14 +1252,13 @@ class Main:
             new_branch = self.combo_model[tree_iter][1]
             try:
                 self.current_repo.git.checkout(new_branch)
-                self.current_repo.state = []
                 self.current_repo.last_finished_state = STATE_NONE
             except git.exc.GitCommandError, detail:
                 self.inform_error("Could not change branches - you probably have uncommitted changes", str(detail))
-            self.update_repos()
+            self.update_repo(self.current_repo)
 
     def on_refresh_clicked(self, button):
-        if len(self.job_manager.jobs) > 0:
+        if self.job_manager.is_busy():
             self.inform("Please wait until all currently running jobs complete before trying to reload the repo list.", "")
             return
 
@@ -523,70 +1266,169 @@ class Main:
         self.write_string_to_buffer("---------------------- LIST RELOADED -----------------------")
 
     def on_clean_clicked(self, button):
-        self.current_repo.state.append(STATE_CLEAN_QUEUED)
         job = Job(self.current_repo, JOB_CLEAN, self.write_to_buffer, self.job_finished_callback)
+        job.interactive = button is not None
+        if self.settings.get_boolean(KEY_FAST_CLEAN):
+            job.trash_reaper = self.trash_reaper
         self.job_manager.add_job(job)
 
     def on_reset_clicked(self, button):
-        self.current_repo.state.append(STATE_RESET_QUEUED)
         job = Job(self.current_repo, JOB_RESET, self.write_to_buffer, self.job_finished_callback)
+        job.interactive = button is not None
         self.job_manager.add_job(job)
 
     def on_rebase_clicked(self, button):
-        self.current_repo.state.append(STATE_REBASE_QUEUED)
         job = Job(self.current_repo, JOB_REBASE, self.write_to_buffer, self.job_finished_callback)
+        job.interactive = True
         self.job_manager.add_job(job)
 
     def on_build_clicked(self, button):
-        self.current_repo.state.append(STATE_BUILD_QUEUED)
-        job = Job(self.current_repo, JOB_BUILD, self.write_to_buffer, self.job_finished_callback)
+        self.queue_build(self.current_repo, force=self.is_force_requested(), interactive=True)
+
+    def get_jobserver(self):
+        if self.jobserver is None:
+            slots = self.settings.get_int(KEY_JOBSERVER_SLOTS)
+            if slots <= 0:
+                slots = get_cpu_count()
+            self.jobserver = buildenv.JobServer(slots, self.settings.get_int(KEY_MAX_BUILD_JOBS))
+        return self.jobserver
+
+    def is_force_requested(self):
+        # Shift-clicking a build button rebuilds even if nothing has changed
+        has_state, state = Gtk.get_current_event_state()
+        return has_state and (state & Gdk.ModifierType.SHIFT_MASK) != 0
+
+    def queue_build(self, repo, depends_on=[], force=False, interactive=False):
+        job = Job(repo, JOB_BUILD, self.write_to_buffer, self.job_finished_callback)
+        job.depends_on = depends_on
+        job.force = force
+        job.interactive = interactive
+        job.background = self.status_refresher
+        if self.settings.get_boolean(KEY_BUILD_WORKTREES):
+            job.isolated = True
+            job.worktree_root = os.path.join(GLib.get_user_cache_dir(), "git-monkey", "worktrees")
+        if self.settings.get_boolean(KEY_SKIP_UNCHANGED_BUILDS):
+            job.build_stamps = self.build_stamps
+        if self.settings.get_boolean(KEY_SHARED_JOBSERVER):
+            job.jobserver = self.get_jobserver()
+        if self.settings.get_int(KEY_ARTIFACT_CACHE_SIZE) > 0:
+            job.artifact_cache = self.artifact_cache
+            self.artifact_cache.max_size = self.settings.get_int(KEY_ARTIFACT_CACHE_SIZE) * 1024 * 1024
         self.job_manager.add_job(job)
+        return job
 
     def on_new_branch_clicked(self, button):
         new_branch = self.ask_new_branch_name("Enter a name for your new branch:")
         if new_branch is not None:
-            self.current_repo.state.append(STATE_NEW_BRANCH_QUEUED)
             job = Job(self.current_repo, JOB_NEW_BRANCH, self.write_to_buffer, self.job_finished_callback)
             job.new_branch_name = new_branch
+            job.interactive = True
             self.job_manager.add_job(job)
 
     def on_pull_request_clicked(self, button):
+        force = self.is_force_requested()
         model, treeiter = self.treeview.get_selection().get_selected()
         if treeiter:
             name = self.model.get_value(treeiter, 1)
-        number = self.ask_pull_request_number("Enter the pull request number to checkout for <b>%s</b>" % (name))
-        if number is not None:
-            self.current_repo.state.append(STATE_PULL_REQUEST_QUEUED)
+        numbers = self.ask_pull_request_number("Enter the pull request numbers to fetch for <b>%s</b>\n"
+                                               "(e.g. <i>123</i> or <i>120-125, 130</i> - the first one is checked out)" % (name))
+        if numbers is not None:
+            self.recent_pull_requests.add(self.current_repo.dir, numbers)
             job = Job(self.current_repo, JOB_CHECKOUT_PR, self.write_to_buffer, self.job_finished_callback)
-            job.new_branch_name = number
+            job.pr_numbers = numbers
+            job.force = force
+            job.interactive = True
             self.job_manager.add_job(job)
 
+    def job_added_callback(self, job):
+        # User jobs always win - whatever maintenance step is running gets stopped
+        if self.maintainer is not None and self.maintainer.is_running():
+            self.maintainer.stop()
+        self.queue_eta_refresh()
+
+    def on_maintenance_timeout(self):
+        if not self.job_manager.is_busy():
+            self.maintainer.run_next([repo.dir for repo in self.get_all_repos() if not self.job_manager.has_jobs(repo)])
+        return True
+
+    def on_maintenance_finished(self, dir, record):
+        # Jobs for the repo were held back until now
+        self.job_manager.queue_dispatch()
+        if record is None:
+            print "Maintenance of %s interrupted" % dir
+            return
+        for name, step in sorted(record["steps"].items()):
+            if not step["ok"]:
+                print "Maintenance of %s: %s failed: %s" % (dir, name, step.get("error", ""))
+        if "failed" in record:
+            print "Maintenance of %s failed, retrying in %d minutes" % (dir, maintenance.RETRY_INTERVAL / 60)
+            return
+        before = record["before"]
+        after = record["after"]
+        print "Maintenance of %s took %.1fs: status %.3fs -> %.3fs, %d -> %d loose objects, %d -> %d packs" % \
+              (dir, record["seconds"], before["status"], after["status"],
+               before.get("count", 0), after.get("count", 0), before.get("packs", 0), after.get("packs", 0))
+
+    def on_pr_prefetch_timeout(self):
+        # Only when idle - a prefetch shouldn't compete with jobs the user asked for
+        if self.job_manager.is_busy():
+            return True
+        for repo in self.get_all_repos():
+            numbers = self.recent_pull_requests.get(repo.dir)
+            if numbers and not self.job_manager.has_jobs(repo):
+                self.pr_prefetcher.prefetch(repo.dir, repo.upstream_remote, numbers)
+        return True
+
     def on_terminal_clicked(self, button):
         subprocess.Popen("gnome-terminal", cwd=self.current_repo.dir, shell=True)
 
     def on_master_clicked(self, button):
         try:
             self.current_repo.git.checkout(self.current_repo.upstream_branch)
-            self.current_repo.state = []
             self.current_repo.last_finished_state = STATE_NONE
         except git.exc.GitCommandError, detail:
             self.inform_error("Could not change branches - you probably have uncommitted changes", str(detail))
-        self.update_repos()
-        self.update_branch_combo(self.current_repo)
+        self.update_repo(self.current_repo)
 
-    def on_build_all_clicked(self, button):
+    def get_all_repos(self):
+        repos = []
         row_iter = self.model.get_iter_first()
         while row_iter != None:
-            self.current_repo = self.model.get_value(row_iter, 0)
-            self.on_build_clicked(None)
+            repos.append(self.model.get_value(row_iter, 0))
             row_iter = self.model.iter_next(row_iter)
+        return repos
+
+    def on_build_all_clicked(self, button):
+        repos = self.get_all_repos()
+
+        # Queue builds wave by wave, each waiting on the builds of the repos it build-depends on
+        graph = buildgraph.BuildGraph(repos)
+        force = self.is_force_requested()
+        jobs = {}
+        for wave in graph.get_waves():
+            for repo in wave:
+                depends_on = [jobs[dep] for dep in graph.deps[repo] if dep in jobs]
+                jobs[repo] = self.queue_build(repo, depends_on, force)
 
     def on_rebase_all_clicked(self, button):
-        row_iter = self.model.get_iter_first()
-        while row_iter != None:
-            self.current_repo = self.model.get_value(row_iter, 0)
-            self.on_rebase_clicked(None)
-            row_iter = self.model.iter_next(row_iter)
+        repos = self.get_all_repos()
+        if self.upstream_monitor is not None:
+            # Leave out repos the monitor has only just seen to have everything upstream has -
+            # the fetch phase still finds out for the others, and skips their rebase if nothing moved
+            repos = [repo for repo in repos if upstream.is_behind(repo.dir, repo.drift)]
+        # Repos fetching from the same host go out next to each other so they share a connection
+        repos = sorted(repos, key=lambda repo: repo.get_remote_host())
+
+        # Fetch everything concurrently first, then rebase each repo locally once its fetch is in
+        fetch_jobs = {}
+        for repo in repos:
+            fetch_jobs[repo] = Job(repo, JOB_FETCH, self.write_to_buffer, self.job_finished_callback)
+            self.job_manager.add_job(fetch_jobs[repo])
+        for repo in repos:
+            job = Job(repo, JOB_REBASE, self.write_to_buffer, self.job_finished_callback)
+            job.local = True
+            job.depends_on = [fetch_jobs[repo]]
+            self.job_manager.add_job(job)
 
     def on_clean_reset_all_clicked(self, button):
         row_iter = self.model.get_iter_first()
@@ -597,20 +1439,17 @@ class Main:
             row_iter = self.model.iter_next(row_iter)
 
     def on_cancel_all_clicked(self, button):
+        repos = [repo for repo in self.get_all_repos() if self.job_manager.has_jobs(repo)]
         self.job_manager.abort_all_jobs()
-        row_iter = self.model.get_iter_first()
-        while row_iter != None:
-            repo = self.model.get_value(row_iter, 0)
-            if repo.state != []:
-                repo.state = []
-                repo.last_finished_state = STATE_ABORTED
-            row_iter = self.model.iter_next(row_iter)
+        for repo in repos:
+            repo.last_finished_state = STATE_ABORTED
+        self.job_manager.refresh_rows()
 
     def on_prefs_button_clicked(self, button):
         self.prefs_dialog.present()
 
     def on_add_repo_button_clicked(self, button):
-        if len(self.job_manager.jobs) > 0:
+        if self.job_manager.is_busy():
             self.inform("Please wait until all currently running jobs complete before trying to add a new repo.", "")
             return
         repoedit.EditRepo()
@@ -633,47 +1472,246 @@ class Main:
             repo_list.remove(item)
             settings.set_strv(KEY_REPOS, repo_list)
 
-    def write_to_buffer(self, fd, condition):
-        if condition == GLib.IO_IN:
-            char = fd.readline()
-            buf = self.output.get_buffer()
-            iter = buf.get_end_iter()
-            buf.insert(iter, char)
-            iter = buf.get_end_iter()
-            self.output.scroll_to_iter(iter, .2, False, 0, 0)
-            # adj = self.output.get_vadjustment()
-            # if adj.get_value() >= adj.get_upper() - adj.get_page_size() - 200.0:
-            # adj.set_value(adj.get_upper())
-            return True
-        else:
-            return False
+    def write_to_buffer(self, fd, condition, job):
+        chunks = []
+        eof = False
+        while True:
+            try:
+                data = os.read(fd.fileno(), OUTPUT_READ_SIZE)
+            except OSError, detail:
+                if detail.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    eof = True
+                break
+            if data == "":
+                eof = True
+                break
+            chunks.append(data)
+            if job.log is not None:
+                job.log.write(data)
+        if eof and job.log is not None:
+            job.log.close()
+
+        # Only hand over whole lines, so output from parallel jobs doesn't interleave mid-line
+        data = self.partial_output.pop(job, "") + "".join(chunks)
+        if not eof:
+            end = data.rfind("\n") + 1
+            if end < len(data):
+                self.partial_output[job] = data[end:]
+            data = data[:end]
+        if data != "":
+            self.queue_output(data)
+        return not eof
 
     def write_string_to_buffer(self, string):
+        self.queue_output("\n" + string + "\n")
+
+    def queue_output(self, text):
+        self.pending_output.append(text)
+        if self.output_flush_id == 0:
+            self.output_flush_id = GLib.timeout_add(OUTPUT_FLUSH_INTERVAL, self.flush_output)
+
+    def flush_output(self):
+        self.output_flush_id = 0
+        text = "".join(self.pending_output)
+        self.pending_output = []
+        scrollback = max(1, self.settings.get_int(KEY_OUTPUT_SCROLLBACK))
+
+        # No point handing GTK lines that would be trimmed straight away
+        if text.count("\n") > scrollback:
+            text = "\n".join(text.split("\n")[-scrollback:])
+
+        buf = self.live_buffer
+        buf.insert(buf.get_end_iter(), text.decode("utf-8", "replace"))
+        excess = buf.get_line_count() - scrollback
+        if excess > 0:
+            buf.delete(buf.get_start_iter(), buf.get_iter_at_line(excess))
+
+        if self.log_path is None:
+            self.scroll_output_to_end()
+        elif self.log_follow:
+            self.show_log_tail()
+        return False
+
+    def scroll_output_to_end(self):
         buf = self.output.get_buffer()
-        iter = buf.get_end_iter()
-        buf.insert(iter, "\n" + string + "\n")
-        iter = buf.get_end_iter()
-        self.output.scroll_to_iter(iter, .2, False, 0, 0)
+        end_mark = buf.get_mark("output-end")
+        if end_mark is None:
+            end_mark = buf.create_mark("output-end", buf.get_end_iter(), False)
+        self.output.scroll_to_mark(end_mark, .2, False, 0, 0)
+
+    def job_started_callback(self, job):
+        if job.repo == self.current_repo:
+            self.update_log_combo(job.repo)
+
+    def update_log_combo(self, repo):
+        self.log_combo.handler_block(self.log_combo_changed_id)
+        self.log_model.clear()
+        active_iter = self.log_model.append(["All jobs (live)", ""])
+        if repo is not None:
+            for name, path in joblog.list_logs(repo.dir):
+                iter = self.log_model.append([name, path])
+                if path == self.log_path:
+                    active_iter = iter
+        self.log_combo.set_active_iter(active_iter)
+        self.log_combo.handler_unblock(self.log_combo_changed_id)
+        self.on_log_combo_changed(self.log_combo)
+
+    def on_log_combo_changed(self, widget):
+        tree_iter = widget.get_active_iter()
+        path = ""
+        if tree_iter != None:
+            path = self.log_model[tree_iter][1]
+        if path == "":
+            self.log_path = None
+            self.output.set_buffer(self.live_buffer)
+            self.log_older_button.set_sensitive(False)
+            self.log_newer_button.set_sensitive(False)
+            self.log_issues = []
+            self.update_issue_navigation()
+            self.scroll_output_to_end()
+        elif path != self.log_path:
+            self.log_path = path
+            self.log_issues = []
+            self.log_issue_pos = -1
+            self.log_index_end = 0
+            self.output.set_buffer(self.log_buffer)
+            self.show_log_tail()
+
+    def show_log_window(self, window, scroll_to_end):
+        text, self.log_start, self.log_end, size = window
+        self.log_buffer.set_text(text.decode("utf-8", "replace"))
+        self.log_older_button.set_sensitive(self.log_start > 0)
+        self.log_newer_button.set_sensitive(self.log_end < size)
+        if scroll_to_end:
+            self.scroll_output_to_end()
+        else:
+            self.output.scroll_to_iter(self.log_buffer.get_start_iter(), 0, False, 0, 0)
+
+    def show_log_tail(self):
+        self.log_follow = True
+        try:
+            self.show_log_window(joblog.read_tail(self.log_path, LOG_WINDOW_LINES), True)
+        except (IOError, OSError, ValueError), detail:
+            self.log_buffer.set_text("Could not read log %s: %s" % (self.log_path, detail))
+        self.load_log_issues()
+
+    def load_log_issues(self):
+        issues, self.log_index_end = joblog.read_index(self.log_path, self.log_index_end)
+        self.log_issues.extend(issues)
+        self.update_issue_navigation()
+
+    def update_issue_navigation(self):
+        self.log_prev_issue_button.set_sensitive(self.log_issue_pos > 0)
+        self.log_next_issue_button.set_sensitive(self.log_issue_pos < len(self.log_issues) - 1)
+        if self.log_path is None:
+            self.log_issue_label.set_markup("")
+            return
+        errors = len([kind for kind, offset in self.log_issues if kind == joblog.ISSUE_ERROR])
+        text = self.get_string_for_issues(errors, len(self.log_issues) - errors)
+        if text == "":
+            text = "No errors or warnings"
+        elif self.log_issue_pos >= 0:
+            text = "%d of %d: %s" % (self.log_issue_pos + 1, len(self.log_issues), text)
+        if errors > 0:
+            text = "<span color='#DF0101'>%s</span>" % text
+        self.log_issue_label.set_markup(text)
+
+    def jump_to_issue(self, pos):
+        self.log_issue_pos = pos
+        kind, offset = self.log_issues[pos]
+        self.log_follow = False
+        window = joblog.read_window(self.log_path, offset, LOG_WINDOW_LINES / 2, LOG_WINDOW_LINES / 2)
+        self.show_log_window(window, False)
+        line = window[0][:offset - window[1]].count("\n")
+        start = self.log_buffer.get_iter_at_line(line)
+        end = start.copy()
+        end.forward_to_line_end()
+        self.log_buffer.apply_tag_by_name("issue", start, end)
+        self.output.scroll_to_iter(start, 0, True, 0, 0.3)
+        self.update_issue_navigation()
+
+    def on_log_prev_issue_clicked(self, button):
+        if self.log_issue_pos > 0:
+            self.jump_to_issue(self.log_issue_pos - 1)
+
+    def on_log_next_issue_clicked(self, button):
+        self.load_log_issues()
+        if self.log_issue_pos < len(self.log_issues) - 1:
+            self.jump_to_issue(self.log_issue_pos + 1)
+
+    def on_log_older_clicked(self, button):
+        self.log_follow = False
+        self.show_log_window(joblog.read_window(self.log_path, self.log_start, LOG_WINDOW_LINES, 0), True)
+
+    def on_log_newer_clicked(self, button):
+        window = joblog.read_window(self.log_path, self.log_end, 0, LOG_WINDOW_LINES)
+        self.log_follow = window[2] >= window[3]
+        self.show_log_window(window, False)
 
     def job_finished_callback(self, job):
-        if not job.aborted:
+        if job.skipped:
+            job.repo.last_finished_state = STATE_SKIPPED
+        elif not job.aborted:
             if job.type == JOB_RESET:
                 job.repo.last_finished_state = STATE_RESETTED
             elif job.type == JOB_CLEAN:
                 job.repo.last_finished_state = STATE_CLEANED
-            elif job.type == JOB_REBASE:
+                if job.trashed is not None:
+                    self.write_string_to_buffer("%s: moved %d paths to the trash" % (job.repo.name, job.trashed))
+            elif job.type == JOB_REBASE and job.up_to_date:
+                job.repo.last_finished_state = STATE_UP_TO_DATE
+            elif job.type == JOB_REBASE and job.succeeded():
                 job.repo.last_finished_state = STATE_REBASED
-            elif job.type == JOB_BUILD:
+            elif job.type == JOB_REBASE:
+                job.repo.last_finished_state = STATE_REBASE_FAILED
+            elif job.type == JOB_FETCH and job.succeeded():
+                job.repo.last_finished_state = STATE_FETCHED
+            elif job.type == JOB_FETCH:
+                job.repo.last_finished_state = STATE_FETCH_FAILED
+            elif job.type == JOB_BUILD and job.up_to_date:
+                job.repo.last_finished_state = STATE_UP_TO_DATE
+            elif job.type == JOB_BUILD and job.restored:
+                job.repo.last_finished_state = STATE_RESTORED
+                self.write_artifact_cache_stats(job, "restored packages from cache")
+            elif job.type == JOB_BUILD and job.succeeded():
                 job.repo.last_finished_state = STATE_BUILT
+                self.build_stamps.record(job.work_dir, job.fingerprint)
+                if job.stale:
+                    self.write_string_to_buffer("%s: packages not cached - the tree changed while they were built" % job.repo.name)
+                elif job.artifact_snapshot is not None:
+                    self.write_artifact_cache_stats(job, "cached %d files" % len(job.stored))
+                if job.published is not None:
+                    self.write_string_to_buffer("%s: moved %d files from the build worktree to %s" % (job.repo.name, len(job.published), job.get_output_dir()))
+            elif job.type == JOB_BUILD:
+                job.repo.last_finished_state = STATE_BUILD_FAILED
+                self.build_stamps.forget(job.work_dir)
             elif job.type == JOB_NEW_BRANCH:
                 job.repo.last_finished_state = STATE_NEW_BRANCH_DONE
             elif job.type == JOB_CHECKOUT_PR:
                 job.repo.last_finished_state = STATE_PULL_REQUEST_CHECKED_OUT
-        front_pop(job.repo.state)
-        self.update_repos()
-        self.update_branch_combo(job.repo)
+            job.repo.last_job_log = job.log
+            job.repo.last_job_usage = job.usage
+            if job.usage is not None:
+                self.job_history.record(job.repo.dir, JOB_NAMES[job.type], job.usage)
+            if job.type == JOB_BUILD:
+                job.collect_ccache_stats()
+                job.repo.last_ccache_stats = job.ccache_stats
+                if job.ccache_stats is not None:
+                    self.write_string_to_buffer("%s: %s" % (job.repo.name, self.get_string_for_ccache_stats(job.ccache_stats)))
+        if self.jobserver is not None and job.type == JOB_BUILD and not self.job_manager.is_building():
+            self.jobserver.reset()
+        self.update_repo(job.repo)
+        if self.upstream_monitor is not None:
+            # Upstream's ref comes from the cache - only the local counts are redone
+            self.upstream_monitor.check([job.repo])
+        if job.repo == self.current_repo:
+            self.update_log_combo(job.repo)
         return False
 
+    def write_artifact_cache_stats(self, job, action):
+        cache = job.artifact_cache
+        self.write_string_to_buffer("%s: %s (artifact cache: %d hits, %d misses)" % (job.repo.name, action, cache.hits, cache.misses))
+
     def ask(self, msg):
         dialog = Gtk.MessageDialog(None,
                                    Gtk.DialogFlags.DESTROY_WITH_PARENT,
@@ -722,24 +1760,19 @@ class Main:
         dialog.set_default_size(400, 200)
         dialog.set_markup(msg)
         entry = Gtk.Entry()
-        entry.set_placeholder_text("Pull request number...")
+        entry.set_placeholder_text("Pull request numbers...")
         box = dialog.get_message_area()
         box.pack_start(entry, False, False, 3)
         dialog.show_all()
         response = dialog.run()
         raw_str = entry.get_text().strip()
         dialog.destroy()
-        valid = " " not in raw_str
-        try:
-            value = int(raw_str)
-        except ValueError:
-            valid = False
-        
+
         if response == Gtk.ResponseType.OK:
-            if valid and raw_str != "":
-                return raw_str
-            else:
-                self.inform_error("Invalid pull request number", "")
+            try:
+                return prcache.parse_numbers(raw_str)
+            except ValueError, detail:
+                self.inform_error("Invalid pull request number", str(detail))
                 return None
         else:
             return None
@@ -776,9 +1809,39 @@ class Main:
     def on_prefs_close_clicked(self, button):
         self.prefs_dialog.hide()
 
+    def on_export_history_clicked(self, button):
+        dialog = Gtk.FileChooserDialog("Export job history", self.prefs_dialog, Gtk.FileChooserAction.SAVE,
+                                       (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_SAVE, Gtk.ResponseType.OK))
+        dialog.set_do_overwrite_confirmation(True)
+        dialog.set_current_name("git-monkey-jobs.csv")
+        for name, pattern in (("CSV", "*.csv"), ("JSON", "*.json")):
+            file_filter = Gtk.FileFilter()
+            file_filter.set_name(name)
+            file_filter.add_pattern(pattern)
+            dialog.add_filter(file_filter)
+        response = dialog.run()
+        path = dialog.get_filename()
+        dialog.destroy()
+        if response != Gtk.ResponseType.OK or path is None:
+            return
+        try:
+            count = self.job_history.export(path)
+        except (IOError, OSError), detail:
+            self.inform_error("Could not export the job history", str(detail))
+            return
+        self.inform("Exported %d jobs" % count, path)
+
     def setup_prefs(self):
         self.settings_build_entry = self.builder.get_object("settings_build_entry")
         self.settings.bind(KEY_BUILD, self.settings_build_entry, "text", Gio.SettingsBindFlags.DEFAULT)
+        self.settings_skip_unchanged = self.builder.get_object("settings_skip_unchanged")
+        self.settings.bind(KEY_SKIP_UNCHANGED_BUILDS, self.settings_skip_unchanged, "active", Gio.SettingsBindFlags.DEFAULT)
+        self.settings_compiler_cache = self.builder.get_object("settings_compiler_cache")
+        self.settings.bind(KEY_COMPILER_CACHE, self.settings_compiler_cache, "active", Gio.SettingsBindFlags.DEFAULT)
+        self.settings_build_worktrees = self.builder.get_object("settings_build_worktrees")
+        self.settings.bind(KEY_BUILD_WORKTREES, self.settings_build_worktrees, "active", Gio.SettingsBindFlags.DEFAULT)
+        self.settings_fast_clean = self.builder.get_object("settings_fast_clean")
+        self.settings.bind(KEY_FAST_CLEAN, self.settings_fast_clean, "active", Gio.SettingsBindFlags.DEFAULT)
 
 if __name__ == "__main__":
     Main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+import os
+import re
+import time
+import mmap
+import shutil
+import hashlib
+from gi.repository import GLib
+
+LOG_FILE = "output.log"
+INDEX_FILE = "issues.idx"
+
+ISSUE_ERROR = "E"
+ISSUE_WARNING = "W"
+
+# Longest partial line we hold on to while waiting for its newline
+MAX_PARTIAL_LINE = 65536
+
+def compile_patterns(error_patterns, warning_patterns):
+    patterns = []
+    for kind, sources in ((ISSUE_ERROR, error_patterns), (ISSUE_WARNING, warning_patterns)):
+        for source in sources:
+            try:
+                patterns.append((kind, re.compile(source, re.MULTILINE)))
+            except re.error, detail:
+                print "Ignoring invalid log pattern '%s': %s" % (source, detail)
+    return patterns
+
+def get_log_root():
+    return os.path.join(GLib.get_user_cache_dir(), "git-monkey", "logs")
+
+def get_repo_log_dir(repo_dir):
+    # Keyed by the repo's path - two repos can have the same name
+    key = hashlib.sha1(os.path.normpath(repo_dir)).hexdigest()[:12]
+    return os.path.join(get_log_root(), key, os.path.basename(os.path.normpath(repo_dir)))
+
+def list_logs(repo_dir):
+    # Newest first - job dirs are named so they sort by start time
+    log_dir = get_repo_log_dir(repo_dir)
+    try:
+        names = sorted(os.listdir(log_dir), reverse=True)
+    except OSError:
+        return []
+    logs = []
+    for name in names:
+        path = os.path.join(log_dir, name, LOG_FILE)
+        if os.path.exists(path):
+            logs.append((name, path))
+    return logs
+
+def prune_logs(repo_dir, keep):
+    for name, path in list_logs(repo_dir)[keep:]:
+        shutil.rmtree(os.path.dirname(path), True)
+
+class JobLog:
+    def __init__(self, repo_dir, job_name, keep=0, patterns=[]):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self.dir = os.path.join(get_repo_log_dir(repo_dir), "%s-%s" % (stamp, job_name))
+        suffix = 1
+        while os.path.exists(self.dir):
+            suffix += 1
+            self.dir = os.path.join(get_repo_log_dir(repo_dir), "%s.%d-%s" % (stamp, suffix, job_name))
+        os.makedirs(self.dir)
+        self.path = os.path.join(self.dir, LOG_FILE)
+        self.file = open(self.path, "wb", 0)
+        self.index_file = open(os.path.join(self.dir, INDEX_FILE), "wb", 0)
+        self.patterns = patterns
+        self.size = 0
+        self.partial = ""
+        self.errors = 0
+        self.warnings = 0
+        if keep > 0:
+            prune_logs(repo_dir, keep)
+
+    def write(self, data):
+        if self.file is None:
+            return
+        self.file.write(data)
+        # Scan lines as they stream past, so the log never has to be re-read
+        buf = self.partial + data
+        base = self.size - len(self.partial)
+        self.size += len(data)
+        pos = 0
+        while True:
+            nl = buf.find("\n", pos)
+            if nl == -1:
+                break
+            self.scan_line(buf, pos, nl, base + pos)
+            pos = nl + 1
+        self.partial = buf[pos:]
+        if len(self.partial) > MAX_PARTIAL_LINE:
+            self.scan_line(self.partial, 0, len(self.partial), self.size - len(self.partial))
+            self.partial = ""
+
+    def scan_line(self, buf, start, end, offset):
+        for kind, pattern in self.patterns:
+            if pattern.search(buf, start, end):
+                self.index_file.write("%s %d\n" % (kind, offset))
+                if kind == ISSUE_ERROR:
+                    self.errors += 1
+                else:
+                    self.warnings += 1
+                return
+
+    def close(self):
+        if self.file is not None:
+            if self.partial != "":
+                self.scan_line(self.partial, 0, len(self.partial), self.size - len(self.partial))
+                self.partial = ""
+            self.file.close()
+            self.index_file.close()
+            self.file = None
+
+def read_index(log_path, start=0):
+    # Returns the issues recorded after byte 'start' of the index, and where to
+    # resume from next time - the index of a running job keeps growing.
+    issues = []
+    try:
+        with open(os.path.join(os.path.dirname(log_path), INDEX_FILE), "rb") as f:
+            f.seek(start)
+            data = f.read()
+    except IOError:
+        return (issues, start)
+    end = data.rfind("\n") + 1
+    for line in data[:end].splitlines():
+        try:
+            kind, offset = line.split()
+            issues.append((kind, int(offset)))
+        except ValueError:
+            pass
+    return (issues, start + end)
+
+def line_start(m, pos):
+    return m.rfind("\n", 0, pos) + 1
+
+def lines_back(m, start, count):
+    while count > 0 and start > 0:
+        start = m.rfind("\n", 0, start - 1) + 1
+        count -= 1
+    return start
+
+def lines_forward(m, end, count, size):
+    while count > 0 and end < size:
+        nl = m.find("\n", end)
+        if nl == -1:
+            return size
+        end = nl + 1
+        count -= 1
+    return end
+
+def read_window(path, offset, before, after):
+    # Returns (text, start, end, size). The log is mapped rather than read, so only
+    # the pages holding the requested window get touched however big the file is.
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return ("", 0, 0, 0)
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offset = min(max(offset, 0), size)
+            start = lines_back(m, line_start(m, offset), before)
+            if offset == size:
+                # Whatever follows the last newline is a line too - e.g. a running job's current one
+                end = size
+            else:
+                end = lines_forward(m, line_start(m, offset), after, size)
+            return (m[start:end], start, end, size)
+        finally:
+            m.close()
+
+def read_tail(path, lines):
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return ("", 0, 0, 0)
+    return read_window(path, size, lines, 0)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+import os
+import ctypes
+import ctypes.util
+
+# Profiles are set up in the child between fork and exec - see JobProfile.apply
+
+IOPRIO_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+
+# glibc has no ioprio_set wrapper, so it's a raw syscall
+IOPRIO_SET_SYSCALLS = {"x86_64": 251, "i386": 289, "i686": 289, "aarch64": 30, "armv7l": 314, "ppc64le": 273}
+
+CPU_SETSIZE = 1024
+
+try:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+except OSError:
+    libc = None
+
+def parse_cpus(value):
+    cpus = set()
+    for part in value.split(" "):
+        if part == "":
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+class JobProfile:
+    def __init__(self):
+        self.nice = 0
+        self.io_class = None
+        self.io_level = 4
+        self.cpus = []
+
+    def parse(self, options):
+        # e.g. "nice=10,io=idle,cpus=2-7 12"
+        for option in options.split(","):
+            if "=" not in option:
+                continue
+            key, value = [item.strip() for item in option.split("=", 1)]
+            if key == "nice":
+                self.nice = int(value)
+            elif key == "io":
+                if "/" in value:
+                    value, level = value.split("/", 1)
+                    self.io_level = int(level)
+                if value not in IOPRIO_CLASSES:
+                    raise ValueError("unknown I/O class '%s'" % value)
+                self.io_class = IOPRIO_CLASSES[value]
+            elif key == "cpus":
+                self.cpus = parse_cpus(value)
+            else:
+                raise ValueError("unknown option '%s'" % key)
+
+    def apply(self):
+        # Runs in the forked child - failures are reported into the job output and otherwise ignored
+        try:
+            if self.nice != 0:
+                os.nice(self.nice)
+            if self.io_class is not None:
+                self.set_io_priority()
+            if self.cpus:
+                self.set_affinity()
+        except Exception, detail:
+            os.write(2, "git-monkey: could not apply job resource profile: %s\n" % detail)
+
+    def set_io_priority(self):
+        syscall = IOPRIO_SET_SYSCALLS.get(os.uname()[4])
+        if libc is None or syscall is None:
+            raise OSError("ioprio_set is not supported on this architecture")
+        value = (self.io_class << IOPRIO_CLASS_SHIFT) | self.io_level
+        if libc.syscall(syscall, IOPRIO_WHO_PROCESS, 0, value) != 0:
+            raise OSError(ctypes.get_errno(), "ioprio_set: %s" % os.strerror(ctypes.get_errno()))
+
+    def set_affinity(self):
+        if libc is None:
+            raise OSError("libc not found")
+        bits = ctypes.sizeof(ctypes.c_ulong) * 8
+        mask = (ctypes.c_ulong * (CPU_SETSIZE / bits))()
+        for cpu in self.cpus:
+            mask[cpu / bits] |= 1 << (cpu % bits)
+        if libc.sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)) != 0:
+            raise OSError(ctypes.get_errno(), "sched_setaffinity: %s" % os.strerror(ctypes.get_errno()))
+
+def parse_profiles(entries):
+    # Entries look like "build:nice=5,cpus=2-7" - returns job name -> JobProfile
+    profiles = {}
+    for entry in entries:
+        if ":" not in entry:
+            print "Ignoring malformed job profile: ", entry
+            continue
+        name, options = entry.split(":", 1)
+        profile = JobProfile()
+        try:
+            profile.parse(options)
+        except ValueError, detail:
+            print "Ignoring job profile '%s': %s" % (entry, detail)
+            continue
+        profiles[name.strip()] = profile
+    return profiles
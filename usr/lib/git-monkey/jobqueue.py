@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import itertools
+import collections
+
+class JobQueue:
+    # Jobs waiting to start, one deque per repo. Only the head of each repo's
+    # deque can start, so dispatching only ever looks at one job per repo and
+    # cancelling a repo drops its deque without touching anyone else's jobs.
+    # Per repo it also keeps the sum of the queued jobs' estimates and how many
+    # of them are interactive, so ranking the heads doesn't walk the queue.
+    def __init__(self):
+        self.queues = {}
+        self.work = {}
+        self.interactive = {}
+        self.count = 0
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(sorted([job for queue in self.queues.itervalues() for job in queue], key=lambda job: job.seq))
+
+    def push(self, job):
+        if job.seq is None:
+            job.seq = next(self.counter)
+        if job.repo not in self.queues:
+            self.queues[job.repo] = collections.deque()
+            self.work[job.repo] = 0
+            self.interactive[job.repo] = 0
+        self.queues[job.repo].append(job)
+        self.account(job, 1)
+
+    def account(self, job, sign):
+        self.count += sign
+        self.work[job.repo] += sign * (job.estimate or 0)
+        if job.interactive:
+            self.interactive[job.repo] += sign
+
+    def pop(self, job):
+        # Only heads leave the queue in the middle of a repo's run
+        queue = self.queues[job.repo]
+        queue.popleft()
+        self.account(job, -1)
+        if not queue:
+            self.drop(job.repo)
+
+    def drop(self, repo):
+        del self.queues[repo]
+        del self.work[repo]
+        del self.interactive[repo]
+
+    def remove_repo(self, repo):
+        if repo not in self.queues:
+            return []
+        queue = self.queues[repo]
+        self.count -= len(queue)
+        self.drop(repo)
+        return queue
+
+    def clear(self):
+        jobs = [job for queue in self.queues.itervalues() for job in queue]
+        self.queues = {}
+        self.work = {}
+        self.interactive = {}
+        self.count = 0
+        return jobs
+
+    def has_repo(self, repo):
+        return repo in self.queues
+
+    def get_head(self, repo):
+        if repo not in self.queues:
+            return None
+        return self.queues[repo][0]
+
+    def get_jobs(self, repo):
+        return list(self.queues.get(repo, ()))
+
+    def get_heads(self):
+        return sorted([queue[0] for queue in self.queues.itervalues()], key=lambda job: job.seq)
+
+    def get_work(self, repo):
+        return self.work.get(repo, 0)
+
+    def has_interactive(self, repo):
+        return self.interactive.get(repo, 0) > 0
+
+    def copy(self):
+        other = JobQueue()
+        other.queues = dict([(repo, collections.deque(queue)) for repo, queue in self.queues.iteritems()])
+        other.work = dict(self.work)
+        other.interactive = dict(self.interactive)
+        other.count = self.count
+        other.counter = self.counter
+        return other
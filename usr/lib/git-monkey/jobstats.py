@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import os
+import csv
+import json
+import time
+import util
+
+MAX_ENTRIES = 100
+
+# Estimates use the median of this many recent successful runs
+ESTIMATE_RUNS = 5
+
+FIELDS = ["repo", "dir", "job", "started", "returncode", "wall", "user", "sys", "max_rss_kb", "read_blocks", "write_blocks"]
+
+def get_usage(rusage, started, returncode):
+    # rusage is what wait4 reported for the job's shell, which covers every
+    # descendant it waited for (i.e. the whole build)
+    usage = {"started": round(started, 3), "wall": round(time.time() - started, 3), "returncode": returncode}
+    if rusage is not None:
+        usage["user"] = round(rusage.ru_utime, 3)
+        usage["sys"] = round(rusage.ru_stime, 3)
+        usage["max_rss_kb"] = rusage.ru_maxrss
+        usage["read_blocks"] = rusage.ru_inblock
+        usage["write_blocks"] = rusage.ru_oublock
+    return usage
+
+class JobHistory:
+    # repo dir -> job name -> most recent runs, oldest first
+    def __init__(self, path):
+        self.path = path
+        self.history = util.load_json(self.path, {})
+
+    def save(self):
+        util.save_json(self.path, self.history, "job history")
+
+    def record(self, dir, job_name, usage):
+        runs = self.history.setdefault(dir, {}).setdefault(job_name, [])
+        runs.append(usage)
+        del runs[:-MAX_ENTRIES]
+        self.save()
+
+    def get_runs(self, dir, job_name):
+        return self.history.get(dir, {}).get(job_name, [])
+
+    def estimate(self, dir, job_name):
+        # Expected wall time in seconds, or None if this repo never ran this job successfully
+        walls = sorted([usage["wall"] for usage in self.get_runs(dir, job_name) if usage["returncode"] == 0][-ESTIMATE_RUNS:])
+        if not walls:
+            return None
+        return walls[len(walls) / 2]
+
+    def get_rows(self):
+        rows = []
+        for dir in sorted(self.history):
+            for job_name in sorted(self.history[dir]):
+                for usage in self.history[dir][job_name]:
+                    row = dict(usage)
+                    row["repo"] = os.path.basename(os.path.normpath(dir))
+                    row["dir"] = dir
+                    row["job"] = job_name
+                    rows.append(row)
+        return rows
+
+    def export(self, path):
+        rows = self.get_rows()
+        with open(path, "wb") as f:
+            if path.endswith(".json"):
+                json.dump(rows, f, indent=1)
+            else:
+                writer = csv.DictWriter(f, FIELDS, extrasaction="ignore")
+                writer.writeheader()
+                writer.writerows(rows)
+        return len(rows)
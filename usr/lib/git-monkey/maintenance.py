@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+import os
+import time
+import signal
+import subprocess
+import threading
+import util
+from gi.repository import GLib
+
+# Run one at a time, so an interrupted run still leaves the earlier steps done.
+# Each step is a list of alternatives - the plumbing ones are for gits without
+# "git maintenance" (< 2.29) or without one of its tasks.
+STEPS = [
+    ("commit-graph", [[["maintenance", "run", "--task=commit-graph"]],
+                      [["commit-graph", "write", "--reachable", "--split"]]]),
+    ("loose-objects", [[["maintenance", "run", "--task=loose-objects"]],
+                       [["prune-packed", "--quiet"], ["repack", "-d", "-q"]]]),
+    ("incremental-repack", [[["maintenance", "run", "--task=incremental-repack"]],
+                            [["multi-pack-index", "write"], ["multi-pack-index", "repack"]]]),
+    ("pack-refs", [[["maintenance", "run", "--task=pack-refs"]],
+                   [["pack-refs", "--all"]]]),
+    ("prune", [[["prune", "--expire=2.weeks.ago"]]])
+]
+
+# A repo where no step worked is tried again after this long (s), not at the next check
+RETRY_INTERVAL = 3600
+
+def probe(dir):
+    # The same kinds of calls git-monkey makes all the time, timed
+    timings = {}
+    for name, args in (("status", ["status", "--porcelain=v2", "--branch"]),
+                       ("branches", ["for-each-ref", "refs/heads"]),
+                       ("log", ["rev-list", "--count", "HEAD"])):
+        start = time.time()
+        util.call_git(dir, args)
+        timings[name] = round(time.time() - start, 4)
+    returncode, output, error = util.call_git(dir, ["count-objects", "-v"])
+    for line in output.splitlines():
+        key, sep, value = line.partition(": ")
+        if key in ("count", "packs", "size-pack") and value.isdigit():
+            timings[key] = int(value)
+    return timings
+
+class Maintainer:
+    def __init__(self, path, interval, callback=None):
+        self.path = path
+        self.interval = interval
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.process = None
+        self.cancelled = False
+        self.current = None
+        self.history = util.load_json(self.path, {})
+
+    def save(self):
+        util.save_json(self.path, self.history, "maintenance history", indent=1)
+
+    def is_running(self):
+        return self.current is not None
+
+    def get_next_due(self, dirs):
+        now = time.time()
+        due = [(self.get_due_time(dir), dir) for dir in dirs]
+        due = [(when, dir) for when, dir in due if when <= now]
+        if not due:
+            return None
+        return min(due)[1]
+
+    def get_due_time(self, dir):
+        entry = self.history.get(dir, {})
+        due = entry.get("finished", 0) + self.interval
+        if "failed" in entry:
+            due = max(due, entry["failed"] + RETRY_INTERVAL)
+        return due
+
+    def run_next(self, dirs):
+        # At most one repo per call - callers pace this with a timer
+        if self.is_running():
+            return False
+        dir = self.get_next_due(dirs)
+        if dir is None:
+            return False
+        self.current = dir
+        self.cancelled = False
+        thread = threading.Thread(target=self.run, args=(dir,))
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def stop(self):
+        with self.lock:
+            self.cancelled = True
+            if self.process is not None:
+                try:
+                    # git cleans up its lock and temp files on SIGTERM
+                    self.process.send_signal(signal.SIGTERM)
+                except OSError:
+                    pass
+
+    def run_git(self, dir, args):
+        # Returns (returncode, error), or None if the run was cancelled first
+        with self.lock:
+            if self.cancelled:
+                return None
+            try:
+                self.process = subprocess.Popen(["git"] + args, cwd=dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                                preexec_fn=lambda: os.nice(19))
+            except OSError, detail:
+                return (None, str(detail))
+        output, error = self.process.communicate()
+        with self.lock:
+            returncode = self.process.returncode
+            self.process = None
+        return (returncode, error)
+
+    def run_step(self, dir, alternatives):
+        # Returns None if ok, the error of the last alternative tried otherwise
+        error = None
+        for commands in alternatives:
+            for args in commands:
+                result = self.run_git(dir, args)
+                if result is None:
+                    return "cancelled"
+                returncode, error = result
+                if returncode != 0:
+                    error = (error.strip().splitlines() or ["git %s failed" % " ".join(args)])[0]
+                    break
+            else:
+                return None
+        return error
+
+    def run(self, dir):
+        start = time.time()
+        before = probe(dir)
+        steps = {}
+        for name, alternatives in STEPS:
+            step_start = time.time()
+            error = self.run_step(dir, alternatives)
+            if self.cancelled:
+                break
+            steps[name] = {"seconds": round(time.time() - step_start, 3), "ok": error is None}
+            if error is not None:
+                steps[name]["error"] = error
+        record = None
+        if not self.cancelled:
+            record = {"seconds": round(time.time() - start, 3), "steps": steps, "before": before, "after": probe(dir)}
+            if any(step["ok"] for step in steps.values()):
+                record["finished"] = time.time()
+            else:
+                record["failed"] = time.time()
+        GLib.idle_add(self.finish, dir, record)
+
+    def finish(self, dir, record):
+        self.current = None
+        if record is not None:
+            # A run where nothing worked isn't done - keep the time of the last one that was
+            last = self.history.get(dir, {})
+            if "failed" in record and "finished" in last:
+                record["finished"] = last["finished"]
+            self.history[dir] = record
+            self.save()
+        if self.callback is not None:
+            self.callback(dir, record)
+        return False
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+import Queue
+import threading
+import util
+
+# Fetched pull requests are kept under their own namespace, out of the way of branches
+PR_REF_PREFIX = "refs/git-monkey/pull/"
+
+MAX_NUMBERS = 50
+MAX_RECENT = 20
+
+def parse_numbers(text):
+    # "12 15-18, 20" -> [12, 15, 16, 17, 18, 20]
+    numbers = []
+    for part in text.replace(",", " ").split():
+        if "-" in part:
+            first, last = [int(item) for item in part.split("-", 1)]
+            if last < first:
+                raise ValueError("bad range '%s'" % part)
+            values = range(first, last + 1)
+        else:
+            values = [int(part)]
+        for value in values:
+            if value <= 0:
+                raise ValueError("bad pull request number %d" % value)
+            if value not in numbers:
+                numbers.append(value)
+        if len(numbers) > MAX_NUMBERS:
+            raise ValueError("more than %d pull requests" % MAX_NUMBERS)
+    if not numbers:
+        raise ValueError("no pull request number given")
+    return numbers
+
+def get_cache_ref(number):
+    return "%s%d" % (PR_REF_PREFIX, number)
+
+def get_fetch_refspecs(numbers):
+    return ["+refs/pull/%d/head:%s" % (number, get_cache_ref(number)) for number in numbers]
+
+def list_cached(repo_dir):
+    output = util.run_git(repo_dir, ["for-each-ref", "--format=%(refname)", PR_REF_PREFIX])
+    cached = set()
+    for line in (output or "").splitlines():
+        try:
+            cached.add(int(line[len(PR_REF_PREFIX):]))
+        except ValueError:
+            continue
+    return cached
+
+class RecentPullRequests:
+    def __init__(self, path):
+        self.path = path
+        self.recent = util.load_json(self.path, {})
+
+    def save(self):
+        util.save_json(self.path, self.recent, "recent pull requests")
+
+    def add(self, dir, numbers):
+        recent = [number for number in self.recent.get(dir, []) if number not in numbers]
+        self.recent[dir] = (list(numbers) + recent)[:MAX_RECENT]
+        self.save()
+
+    def get(self, dir):
+        return self.recent.get(dir, [])
+
+class PullRequestPrefetcher:
+    # Keeps cached pull request refs current in the background, one repo at a time
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        thread = threading.Thread(target=self.worker)
+        thread.daemon = True
+        thread.start()
+
+    def prefetch(self, dir, remote, numbers):
+        with self.lock:
+            if dir in self.pending:
+                return
+            self.pending.add(dir)
+        self.queue.put((dir, remote, numbers))
+
+    def worker(self):
+        while True:
+            dir, remote, numbers = self.queue.get()
+            if util.run_git(dir, ["fetch", "--quiet", remote] + get_fetch_refspecs(numbers)) is None:
+                print "Background fetch of pull requests failed for %s" % dir
+            with self.lock:
+                self.pending.discard(dir)
+            self.queue.task_done()
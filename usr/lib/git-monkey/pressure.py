@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+# Readers for the kernel's load average and pressure stall information (PSI).
+# Anything missing (e.g. a kernel without PSI) reads as None.
+
+def read_loadavg():
+    try:
+        with open("/proc/loadavg") as f:
+            return float(f.read().split()[0])
+    except (IOError, ValueError, IndexError):
+        return None
+
+def read_pressure(resource):
+    # The 'some' avg10 figure: % of the last 10s at least one task stalled on this resource
+    try:
+        with open("/proc/pressure/%s" % resource) as f:
+            for line in f:
+                fields = line.split()
+                if fields and fields[0] == "some":
+                    for field in fields[1:]:
+                        if field.startswith("avg10="):
+                            return float(field[6:])
+    except (IOError, ValueError):
+        pass
+    return None
+
+def over(value, threshold):
+    return value is not None and threshold > 0 and value > threshold
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+import os
+import threading
+import Queue
+import util
+from gi.repository import GLib
+
+STATUS_ARGS = ["status", "--porcelain=v2", "--branch", "-z"]
+
+# Files inside .git that change whenever anything git status reports could change
+SIGNATURE_FILES = ("index", "HEAD", "packed-refs", "FETCH_HEAD")
+
+class RepoStatus:
+    def __init__(self):
+        self.oid = None
+        self.branch = None
+        self.upstream = None
+        self.ahead = 0
+        self.behind = 0
+        self.staged = 0
+        self.unstaged = 0
+        self.conflicts = 0
+        self.untracked = 0
+        self.valid = False
+
+    def is_dirty(self):
+        return self.staged > 0 or self.unstaged > 0 or self.conflicts > 0
+
+    def has_untracked(self):
+        return self.untracked > 0
+
+    def is_detached(self):
+        return self.branch is None
+
+def count_change(status, xy):
+    if xy[0] != ".":
+        status.staged += 1
+    if xy[1] != ".":
+        status.unstaged += 1
+
+def parse_status(output):
+    status = RepoStatus()
+    entries = output.split("\0")
+    i = 0
+    while i < len(entries):
+        entry = entries[i]
+        i += 1
+        if entry == "":
+            continue
+        if entry.startswith("# "):
+            fields = entry[2:].split(" ")
+            key = fields[0]
+            if key == "branch.oid" and fields[1] != "(initial)":
+                status.oid = fields[1]
+            elif key == "branch.head" and fields[1] != "(detached)":
+                status.branch = fields[1]
+            elif key == "branch.upstream":
+                status.upstream = fields[1]
+            elif key == "branch.ab":
+                status.ahead = int(fields[1].lstrip("+"))
+                status.behind = int(fields[2].lstrip("-"))
+        elif entry[0] == "1":
+            count_change(status, entry[2:4])
+        elif entry[0] == "2":
+            count_change(status, entry[2:4])
+            # Renames and copies carry the original path as an extra field
+            i += 1
+        elif entry[0] == "u":
+            status.conflicts += 1
+        elif entry[0] == "?":
+            status.untracked += 1
+    status.valid = True
+    return status
+
+def get_status(dir):
+    returncode, output, error = util.call_git(dir, STATUS_ARGS)
+    if returncode is None:
+        print "Could not run git status in %s: %s" % (dir, error)
+        return RepoStatus()
+    if returncode != 0:
+        print "git status failed in %s: %s" % (dir, error.strip())
+        return RepoStatus()
+    return parse_status(output)
+
+def stat_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size, st.st_ino]
+
+def get_signature(dir):
+    git_dir = os.path.join(dir, ".git")
+    signature = []
+    for name in SIGNATURE_FILES:
+        signature.append([name, stat_signature(os.path.join(git_dir, name))])
+    # New commits move the branch ref, not HEAD itself
+    try:
+        with open(os.path.join(git_dir, "HEAD")) as f:
+            head = f.read().strip()
+        if head.startswith("ref: "):
+            ref = head[5:]
+            signature.append([ref, stat_signature(os.path.join(git_dir, ref))])
+    except IOError:
+        pass
+    signature.append(["", stat_signature(dir)])
+    try:
+        entries = sorted(os.listdir(dir))
+    except OSError:
+        entries = []
+    for name in entries:
+        if name != ".git":
+            signature.append([name, stat_signature(os.path.join(dir, name))])
+    return signature
+
+class StatusCache:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.save_id = 0
+        self.load()
+
+    def load(self):
+        self.entries = util.load_json(self.path, {})
+
+    def save(self):
+        self.save_id = 0
+        # Entries are replaced, never changed in place, so a copy is safe to write out
+        with self.lock:
+            entries = dict(self.entries)
+        util.save_json(self.path, entries, "status cache")
+        return False
+
+    def queue_save(self):
+        if self.save_id == 0:
+            self.save_id = GLib.timeout_add_seconds(2, self.save)
+
+    def get_last_known(self, dir):
+        with self.lock:
+            entry = self.entries.get(dir)
+        if entry is None:
+            return None
+        status = RepoStatus()
+        status.__dict__.update(entry["status"])
+        return status
+
+    def lookup(self, dir, signature):
+        with self.lock:
+            entry = self.entries.get(dir)
+            if entry is None or entry["signature"] != signature:
+                self.misses += 1
+                return None
+            self.hits += 1
+        status = RepoStatus()
+        status.__dict__.update(entry["status"])
+        return status
+
+    def store(self, dir, signature, status):
+        with self.lock:
+            self.entries[dir] = {"signature": signature, "status": vars(status)}
+
+class StatusRefresher:
+    def __init__(self, workers, callback, cache=None):
+        self.callback = callback
+        self.cache = cache
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        # Each repo dir maps to the latest requested refresh; anything older is stale
+        self.generations = {}
+        for i in range(max(1, workers)):
+            thread = threading.Thread(target=self.worker)
+            thread.daemon = True
+            thread.start()
+
+    def refresh(self, repos, force=False):
+        with self.lock:
+            for repo in repos:
+                generation = self.generations.get(repo.dir, 0) + 1
+                self.generations[repo.dir] = generation
+                self.queue.put((self.refresh_repo, (repo, generation, force)))
+
+    def run_in_background(self, func, args, callback):
+        # Other slow git work shares the pool - callback(result) is called from the main loop
+        self.queue.put((self.run_task, (func, args, callback)))
+
+    def cancel_all(self):
+        with self.lock:
+            for dir in self.generations.keys():
+                self.generations[dir] += 1
+
+    def is_current(self, repo, generation):
+        with self.lock:
+            return self.generations.get(repo.dir) == generation
+
+    def worker(self):
+        while True:
+            func, args = self.queue.get()
+            func(*args)
+            self.queue.task_done()
+
+    def refresh_repo(self, repo, generation, force):
+        if self.is_current(repo, generation):
+            status = self.compute_status(repo, force)
+            if self.is_current(repo, generation):
+                GLib.idle_add(self.deliver, repo, generation, status)
+
+    def run_task(self, func, args, callback):
+        try:
+            result = func(*args)
+        except Exception, detail:
+            print "Background task failed: %s" % detail
+            result = None
+        GLib.idle_add(self.deliver_task, callback, result)
+
+    def deliver_task(self, callback, result):
+        callback(result)
+        return False
+
+    def compute_status(self, repo, force):
+        if self.cache is None:
+            return get_status(repo.dir)
+        # Take the signature first, so a change made while git status runs is
+        # caught by the next lookup rather than hidden behind a stale entry
+        signature = get_signature(repo.dir)
+        if not force:
+            status = self.cache.lookup(repo.dir, signature)
+            if status is not None:
+                return status
+        status = get_status(repo.dir)
+        if status.valid:
+            self.cache.store(repo.dir, signature, status)
+        return status
+
+    def deliver(self, repo, generation, status):
+        if self.is_current(repo, generation):
+            repo.status = status
+            if self.cache is not None:
+                self.cache.queue_save()
+            self.callback(repo)
+        return False
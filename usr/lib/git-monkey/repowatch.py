@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+import os
+import threading
+import util
+from gi.repository import Gio, GLib
+
+# Files directly inside .git whose changes affect what we display
+GIT_DIR_FILES = ("HEAD", "index", "packed-refs", "ORIG_HEAD", "MERGE_HEAD", "REBASE_HEAD", "CHERRY_PICK_HEAD")
+
+# Worktrees with more directories than this aren't watched at all
+MAX_WORKTREE_WATCHES = 2000
+
+# Share of the user's inotify watches all worktrees together may use - other apps need them too
+WATCH_BUDGET_SHARE = 0.5
+
+def get_watch_budget():
+    try:
+        with open("/proc/sys/fs/inotify/max_user_watches") as f:
+            return int(int(f.read()) * WATCH_BUDGET_SHARE)
+    except (IOError, ValueError):
+        return 4096
+
+def list_tracked_dirs(dir):
+    output = util.run_git(dir, ["ls-files", "-z"])
+    if output is None:
+        return []
+    dirs = set([""])
+    for path in output.split("\0"):
+        path = os.path.dirname(path)
+        while path not in dirs:
+            dirs.add(path)
+            path = os.path.dirname(path)
+    return [os.path.join(dir, d) for d in sorted(dirs)]
+
+class RepoWatcher:
+    def __init__(self, debounce, callback):
+        self.debounce = debounce
+        self.callback = callback
+        self.monitors = {}
+        self.pending = set()
+        self.timeout_id = 0
+        self.budget = get_watch_budget()
+        # repo dir -> number of watches spent on its worktree
+        self.worktree_watches = {}
+
+    def watch(self, repo, worktree=True):
+        self.unwatch(repo)
+        self.monitors[repo.dir] = []
+        git_dir = os.path.join(repo.dir, ".git")
+        self.add_monitor(repo, git_dir, self.on_git_dir_changed)
+        for root, dirs, files in os.walk(os.path.join(git_dir, "refs")):
+            self.add_monitor(repo, root, self.on_refs_changed)
+        if worktree:
+            thread = threading.Thread(target=self.find_worktree_dirs, args=(repo,))
+            thread.daemon = True
+            thread.start()
+
+    def unwatch(self, repo):
+        for monitor in self.monitors.pop(repo.dir, []):
+            monitor.cancel()
+        self.worktree_watches.pop(repo.dir, None)
+        self.pending.discard(repo)
+
+    def unwatch_all(self):
+        for monitors in self.monitors.values():
+            for monitor in monitors:
+                monitor.cancel()
+        self.monitors = {}
+        self.worktree_watches = {}
+        self.pending.clear()
+
+    def add_monitor(self, repo, path, handler):
+        if repo.dir not in self.monitors:
+            return False
+        try:
+            monitor = Gio.File.new_for_path(path).monitor_directory(Gio.FileMonitorFlags.NONE, None)
+        except GLib.GError, detail:
+            print "Could not watch %s: %s" % (path, detail.message)
+            return False
+        monitor.connect("changed", handler, repo)
+        self.monitors[repo.dir].append(monitor)
+        return True
+
+    def find_worktree_dirs(self, repo):
+        dirs = list_tracked_dirs(repo.dir)
+        GLib.idle_add(self.add_worktree_monitors, repo, dirs)
+
+    def add_worktree_monitors(self, repo, dirs):
+        if repo.dir not in self.monitors:
+            return False
+        # All or nothing - a partly watched worktree would miss edits without saying so
+        if len(dirs) > MAX_WORKTREE_WATCHES:
+            print "Not watching the working tree of %s: it has %d directories, more than the %d watched per repo" % \
+                  (repo.dir, len(dirs), MAX_WORKTREE_WATCHES)
+            return False
+        left = self.budget - sum(self.worktree_watches.values())
+        if len(dirs) > left:
+            print "Not watching the working tree of %s: it needs %d inotify watches and only %d of the budget are left " \
+                  "(raise fs.inotify.max_user_watches to watch it)" % (repo.dir, len(dirs), max(0, left))
+            return False
+        count = 0
+        for path in dirs:
+            if self.add_monitor(repo, path, self.on_worktree_changed):
+                count += 1
+        self.worktree_watches[repo.dir] = count
+        return False
+
+    def on_git_dir_changed(self, monitor, file, other_file, event_type, repo):
+        if file.get_basename() in GIT_DIR_FILES:
+            self.queue_repo(repo)
+
+    def on_refs_changed(self, monitor, file, other_file, event_type, repo):
+        name = file.get_basename()
+        if name.endswith(".lock"):
+            return
+        if event_type == Gio.FileMonitorEvent.CREATED and os.path.isdir(file.get_path()):
+            self.add_monitor(repo, file.get_path(), self.on_refs_changed)
+        self.queue_repo(repo)
+
+    def on_worktree_changed(self, monitor, file, other_file, event_type, repo):
+        if file.get_basename() == ".git":
+            return
+        self.queue_repo(repo)
+
+    def queue_repo(self, repo):
+        self.pending.add(repo)
+        # Collect everything that changes within the window into one refresh. The
+        # timer is not restarted, so a constantly busy repo can't starve the others.
+        if self.timeout_id == 0:
+            self.timeout_id = GLib.timeout_add(self.debounce, self.flush)
+
+    def flush(self):
+        self.timeout_id = 0
+        repos = list(self.pending)
+        self.pending.clear()
+        if repos:
+            self.callback(repos)
+        return False
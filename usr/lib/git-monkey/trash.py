@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+import os
+import time
+import shutil
+import subprocess
+import util
+import jobprofile
+from gi.repository import GLib
+
+# A clean only renames things into a trash dir on the same filesystem - the
+# actual unlinking happens later, in the background, at idle priority
+
+TRASH_NAME = ".git-monkey-trash-%d" % os.getuid()
+
+def get_mount_point(path):
+    path = os.path.realpath(path)
+    dev = os.stat(path).st_dev
+    while path != "/":
+        parent = os.path.dirname(path)
+        if os.stat(parent).st_dev != dev:
+            break
+        path = parent
+    return path
+
+def get_trash_root(repo_dir):
+    # Prefer one trash per filesystem, at its root - fall back to inside the repo's .git
+    dev = os.stat(repo_dir).st_dev
+    mount = get_mount_point(repo_dir)
+    if os.access(mount, os.W_OK):
+        return os.path.join(mount, TRASH_NAME)
+    home_trash = os.path.join(GLib.get_user_cache_dir(), "git-monkey", "trash")
+    if os.path.isdir(os.path.dirname(home_trash)) and os.stat(os.path.dirname(home_trash)).st_dev == dev:
+        return home_trash
+    git_dir = util.run_git(repo_dir, ["rev-parse", "--absolute-git-dir"])
+    if git_dir is None:
+        return None
+    return os.path.join(git_dir.strip(), "git-monkey-trash")
+
+def list_untracked(repo_dir):
+    # What git clean -fdx would remove: untracked and ignored, whole directories collapsed
+    output = util.run_git(repo_dir, ["ls-files", "-z", "--others", "--directory"])
+    if output is None:
+        return None
+    paths = []
+    for path in output.split("\0"):
+        if path == "":
+            continue
+        # git clean leaves nested repositories alone without a second -f
+        if path.endswith("/") and os.path.exists(os.path.join(repo_dir, path, ".git")):
+            continue
+        paths.append(path.rstrip("/"))
+    return paths
+
+def move_to_trash(repo_dir, paths, trash_root):
+    # Returns the batch dir holding everything moved, and the paths that couldn't be
+    if not os.path.isdir(trash_root):
+        os.makedirs(trash_root, 0700)
+    batch = os.path.join(trash_root, "%d-%d-%s" % (time.time(), os.getpid(), os.path.basename(repo_dir)))
+    os.mkdir(batch)
+    failed = []
+    for i, path in enumerate(paths):
+        try:
+            os.rename(os.path.join(repo_dir, path), os.path.join(batch, str(i)))
+        except OSError:
+            failed.append(path)
+    return (batch, failed)
+
+def remove_now(repo_dir, paths):
+    for path in paths:
+        full_path = os.path.join(repo_dir, path)
+        try:
+            if os.path.isdir(full_path) and not os.path.islink(full_path):
+                shutil.rmtree(full_path)
+            else:
+                os.remove(full_path)
+        except OSError, detail:
+            print "Could not remove %s: %s" % (full_path, detail)
+
+class TrashReaper:
+    def __init__(self):
+        self.batches = []
+        self.process = None
+        self.profile = jobprofile.JobProfile()
+        self.profile.parse("nice=19,io=idle")
+
+    def add(self, batch):
+        self.batches.append(batch)
+        self.reap_next()
+
+    def add_leftovers(self, trash_root):
+        # Batches from an earlier session that didn't get deleted
+        try:
+            names = os.listdir(trash_root)
+        except OSError:
+            return
+        for name in names:
+            batch = os.path.join(trash_root, name)
+            if batch not in self.batches:
+                self.add(batch)
+
+    def reap_next(self):
+        if self.process is not None or not self.batches:
+            return
+        batch = self.batches.pop(0)
+        try:
+            self.process = subprocess.Popen(["rm", "-rf", "--", batch], preexec_fn=self.profile.apply)
+        except OSError, detail:
+            print "Could not empty trash %s: %s" % (batch, detail)
+            return
+        GLib.child_watch_add(GLib.PRIORITY_LOW, self.process.pid, self.on_reaped, batch)
+
+    def on_reaped(self, pid, status, batch):
+        self.process = None
+        if status != 0:
+            print "Could not fully delete %s" % batch
+        self.reap_next()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+import os
+import time
+import threading
+import Queue
+import util
+from gi.repository import GLib
+
+# Failing remotes are retried at the normal interval, doubling up to this
+MAX_BACKOFF = 3600
+
+# An upstream sha older than this (s) may miss a recent push, so it can't rule out a rebase
+MAX_TRUSTED_AGE = 30
+
+class Drift:
+    def __init__(self):
+        self.sha = None
+        self.ahead = 0
+        self.behind = 0
+        # False when upstream has commits that haven't been fetched yet, so they can't be counted
+        self.fetched = True
+        self.error = None
+        self.checked = 0
+
+def get_env():
+    # Never block a background thread on a password prompt
+    env = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+    if "GIT_SSH" not in env and "GIT_SSH_COMMAND" not in env:
+        env["GIT_SSH_COMMAND"] = "ssh -o BatchMode=yes"
+    return env
+
+def ls_remote(dir, remote, branch):
+    returncode, output, error = util.call_git(dir, ["ls-remote", "--heads", remote, "refs/heads/%s" % branch], get_env())
+    if returncode is None:
+        return (None, error)
+    if returncode != 0:
+        return (None, error.strip().splitlines()[0] if error.strip() else "ls-remote failed")
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[1] == "refs/heads/%s" % branch:
+            return (fields[0], None)
+    return (None, "no branch '%s' on %s" % (branch, remote))
+
+def count_drift(dir, sha, drift):
+    drift.sha = sha
+    if util.run_git(dir, ["cat-file", "-e", "%s^{commit}" % sha]) is None:
+        drift.fetched = False
+        return drift
+    output = util.run_git(dir, ["rev-list", "--left-right", "--count", "HEAD...%s" % sha])
+    if output is None:
+        drift.error = "could not compare with HEAD"
+        return drift
+    ahead, behind = output.split()
+    drift.ahead = int(ahead)
+    drift.behind = int(behind)
+    return drift
+
+def is_behind(dir, drift):
+    if drift is None or drift.sha is None or time.time() - drift.checked > MAX_TRUSTED_AGE:
+        return True
+    # HEAD may have moved since the last check
+    return util.run_git(dir, ["merge-base", "--is-ancestor", drift.sha, "HEAD"]) is None
+
+class RemoteEntry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sha = None
+        self.error = None
+        self.checked = 0
+        self.failures = 0
+        self.retry_at = 0
+
+class UpstreamMonitor:
+    # Repos sharing a remote url and branch share one ls-remote per interval
+    def __init__(self, workers, interval, callback):
+        self.interval = interval
+        self.callback = callback
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.remotes = {}
+        self.pending = set()
+        for i in range(max(1, workers)):
+            thread = threading.Thread(target=self.worker)
+            thread.daemon = True
+            thread.start()
+
+    def check(self, repos):
+        with self.lock:
+            for repo in repos:
+                if repo.dir in self.pending:
+                    continue
+                self.pending.add(repo.dir)
+                self.queue.put(repo)
+
+    def get_entry(self, key):
+        with self.lock:
+            if key not in self.remotes:
+                self.remotes[key] = RemoteEntry()
+            return self.remotes[key]
+
+    def lookup(self, dir, remote, branch):
+        url = util.run_git(dir, ["ls-remote", "--get-url", remote])
+        entry = self.get_entry(((url or remote).strip(), branch))
+        with entry.lock:
+            now = time.time()
+            fresh = now - entry.checked < self.interval
+            if not fresh and now >= entry.retry_at:
+                entry.sha, entry.error = ls_remote(dir, remote, branch)
+                entry.checked = now
+                if entry.error is None:
+                    entry.failures = 0
+                    entry.retry_at = 0
+                else:
+                    entry.failures += 1
+                    entry.retry_at = now + min(self.interval * 2 ** entry.failures, MAX_BACKOFF)
+            return (entry.sha, entry.error, entry.checked)
+
+    def worker(self):
+        while True:
+            repo = self.queue.get()
+            with self.lock:
+                self.pending.discard(repo.dir)
+            sha, error, checked = self.lookup(repo.dir, repo.upstream_remote, repo.upstream_branch)
+            drift = Drift()
+            drift.checked = checked
+            if sha is None:
+                drift.error = error
+            else:
+                count_drift(repo.dir, sha, drift)
+            GLib.idle_add(self.deliver, repo, drift)
+            self.queue.task_done()
+
+    def deliver(self, repo, drift):
+        repo.drift = drift
+        self.callback(repo)
+        return False
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+import os
+import json
+import hashlib
+import subprocess
+
+def get_git_env():
+    # Don't let read-only queries refresh and rewrite the index - that would wake the watchers
+    return dict(os.environ, GIT_OPTIONAL_LOCKS="0")
+
+def call_git(dir, args, env=None):
+    # Returns (returncode, output, error) - returncode is None if git couldn't be run at all
+    try:
+        process = subprocess.Popen(["git"] + args, cwd=dir, env=env or get_git_env(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, error = process.communicate()
+    except OSError, detail:
+        return (None, "", str(detail))
+    return (process.returncode, output, error)
+
+def run_git(dir, args, env=None):
+    # Returns git's output, or None if it failed
+    returncode, output, error = call_git(dir, args, env)
+    if returncode != 0:
+        return None
+    return output
+
+def hash_git(dir, args):
+    # Like run_git, but hashes the output as it streams out instead of holding on to it
+    digest = hashlib.sha1()
+    try:
+        with open(os.devnull, "w") as devnull:
+            process = subprocess.Popen(["git"] + args, cwd=dir, env=get_git_env(), stdout=subprocess.PIPE, stderr=devnull)
+            for chunk in iter(lambda: process.stdout.read(65536), ""):
+                digest.update(chunk)
+            process.wait()
+    except (IOError, OSError):
+        return None
+    if process.returncode != 0:
+        return None
+    return digest.hexdigest()
+
+def load_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return default
+
+def save_json(path, data, what, indent=None):
+    # Written to the side and renamed over, so a crash never leaves half a file
+    try:
+        parent = os.path.dirname(path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=indent)
+        os.rename(tmp, path)
+    except (IOError, OSError), detail:
+        print "Could not save %s: %s" % (what, detail)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+import os
+import pipes
+import shutil
+import hashlib
+import artifactcache
+
+# One build worktree per repo, kept between builds so incremental objects survive:
+#   <root>/<hash of repo dir>/<repo name>
+# dpkg-buildpackage writes its packages into <root>/<hash of repo dir>/
+
+def get_worktree_dir(root, repo_dir):
+    key = hashlib.sha1(os.path.normpath(repo_dir)).hexdigest()[:12]
+    return os.path.join(root, key, os.path.basename(os.path.normpath(repo_dir)))
+
+def get_prepare_cmd(work_dir, commit):
+    # Run from the main checkout - untracked build products in an existing worktree are left alone
+    if os.path.exists(os.path.join(work_dir, ".git")):
+        return "git -C %s checkout --quiet --detach --force %s" % (pipes.quote(work_dir), commit)
+    parent = os.path.dirname(work_dir)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    return "git worktree prune && git worktree add --detach --force %s %s" % (pipes.quote(work_dir), commit)
+
+def publish(repo_dir, src_dir, dest_dir, before):
+    # Move the packages a worktree build produced to where an in-place build would have put them
+    prefixes = artifactcache.get_package_prefixes(repo_dir)
+    after = artifactcache.snapshot_dir(src_dir)
+    published = []
+    for name in after:
+        if after[name] == before.get(name) or not any(name.startswith(prefix) for prefix in prefixes):
+            continue
+        try:
+            shutil.move(os.path.join(src_dir, name), os.path.join(dest_dir, name))
+            published.append(name)
+        except (IOError, OSError), detail:
+            print "Could not move %s to %s: %s" % (name, dest_dir, detail)
+    return published